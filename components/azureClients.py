@@ -0,0 +1,78 @@
+import os
+import aiohttp
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.ai.formrecognizer.aio import DocumentAnalysisClient
+from dotenv import load_dotenv
+from components.formSchemas import get_form_schema
+
+load_dotenv()
+
+# Size of the keep-alive connection pool shared by all Form Recognizer clients
+AZURE_POOL_SIZE = int(os.getenv("AZURE_POOL_SIZE", "100"))
+AZURE_KEEPALIVE_SECONDS = float(os.getenv("AZURE_KEEPALIVE_SECONDS", "60"))
+AZURE_API_VERSION = os.getenv("AZURE_API_VERSION", "2023-07-31")
+
+_credentials = None
+_session = None
+_clients = {}
+
+
+def _load_credentials() -> dict:
+    # Read once; each form schema names the credential pair it uses
+    global _credentials
+    if _credentials is None:
+        _credentials = {
+            "primary": (os.getenv("ENDPOINT"), os.getenv("KEY")),
+            "voter": (os.getenv("ENDPOINT2"), os.getenv("KEY2")),
+        }
+    return _credentials
+
+
+def credentials_for_form(form_number: int) -> tuple:
+    return _load_credentials()[get_form_schema(form_number).credentials]
+
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=AZURE_POOL_SIZE, keepalive_timeout=AZURE_KEEPALIVE_SECONDS)
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+def get_client(endpoint: str, key: str) -> DocumentAnalysisClient:
+    """Return the long-lived client for an endpoint/key pair, creating it on first use."""
+    client = _clients.get((endpoint, key))
+    if client is None:
+        transport = AioHttpTransport(session=_get_session(), session_owner=False)
+        client = DocumentAnalysisClient(
+            endpoint=endpoint,
+            credential=AzureKeyCredential(key),
+            transport=transport,
+            api_version=AZURE_API_VERSION,
+        )
+        _clients[(endpoint, key)] = client
+    return client
+
+
+def get_client_for_form(form_number: int) -> DocumentAnalysisClient:
+    endpoint, key = credentials_for_form(form_number)
+    return get_client(endpoint, key)
+
+
+async def start_clients():
+    # Build every configured client up front so the first request skips the setup
+    for endpoint, key in _load_credentials().values():
+        if endpoint and key:
+            get_client(endpoint, key)
+
+
+async def close_clients():
+    global _session
+    for client in _clients.values():
+        await client.close()
+    _clients.clear()
+    if _session is not None:
+        await _session.close()
+        _session = None
@@ -0,0 +1,79 @@
+import asyncio
+import os
+from datetime import datetime
+import model as Model
+from components.fieldResult import dumps
+from components.executor import run
+from components.eventBus import publish_task
+from components.ingest import discard
+from components.logApi import log_api_calls
+from components.logAudit import log_audit_event
+from components.logDocument import log_documents_processing, update_document_processing
+from components.userStatistics import update_user_statistics
+
+
+# Analyses in flight for one batch request; the per-model limits in the executor still apply
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_ENDPOINT = "/extract/batch/"
+
+
+async def register_batch(user_id: str, items: list) -> list:
+    """Create the documents rows for a batch with one insert_many; returns their ids."""
+    return await log_documents_processing(user_id, [
+        {"document_name": ingested.filename, "size": ingested.size, "doc_type": ingested.content_type or "", "pages": ingested.pages}
+        for ingested, _ in items
+    ])
+
+
+async def iter_batch_results(user_id: str, items: list, document_ids: list):
+    """Analyse [(IngestedFile, form_number), ...] concurrently and yield one NDJSON line per file as it finishes.
+
+    Usage is logged once for the whole batch when the last file is done. Every
+    ingested file is removed at the end, also when the client disconnects early.
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def analyse(index: int):
+        ingested, form_number = items[index]
+        line = {"index": index, "filename": ingested.filename, "document_id": document_ids[index], "form_number": form_number}
+        async with semaphore:
+            start_time = datetime.utcnow()
+            try:
+                output, signature_coordinates = await run(Model.NEURAL_MODELS.get(form_number, ""), Model.extract_with_signature_async, ingested.path, form_number, ingested.sha256)
+            except Exception as e:
+                print(f"Error during batch extract of {ingested.filename}: {e}")
+                line.update(status="failed", error=str(e))
+                return line, None
+            finally:
+                discard(ingested)
+        line.update(status="processed", processing_duration=round((datetime.utcnow() - start_time).total_seconds(), 1), result=output)
+        return line, signature_coordinates
+
+    tasks = [asyncio.create_task(analyse(index)) for index in range(len(items))]
+    calls = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            line, signature_coordinates = await next_done
+            calls.append((line["document_id"], "success" if line["status"] == "processed" else "error"))
+            await publish_task(update_document_processing,
+                user_id=user_id,
+                doc_id=line["document_id"],
+                status=line["status"],
+                processing_duration=line.get("processing_duration", 0),
+                signature_coordinates=signature_coordinates,
+                field_pages=Model.field_pages(line["result"]) if "result" in line else None
+            )
+            yield dumps(line) + b"\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for ingested, _ in items:
+            discard(ingested)
+
+        if calls:
+            processed = sum(1 for _, status in calls if status == "success")
+            await log_api_calls(user_id, calls, BATCH_ENDPOINT)
+            await log_audit_event(user_id, "batch_processed", f"{processed} of {len(items)} documents")
+            await log_audit_event(user_id, "API_call_made", BATCH_ENDPOINT)
+            await update_user_statistics(user_id, documents_processed=processed, api_calls=len(calls))
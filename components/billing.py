@@ -0,0 +1,241 @@
+import csv
+import io
+import os
+import zlib
+from datetime import datetime
+from typing import Optional
+from bson import ObjectId
+from components.database import get_collection
+
+
+# Versioned rate table; a new entry applies from its effective month onwards
+RATE_TABLE = [
+    {"version": 1, "effective_from": "2024-01", "document_rate_per_kb": 0.02, "api_rate": 0.05},
+]
+
+
+def rates_for_month(month: Optional[str] = None) -> dict:
+    month = month or datetime.utcnow().strftime("%Y-%m")
+    applicable = [rates for rates in RATE_TABLE if rates["effective_from"] <= month]
+    return max(applicable, key=lambda rates: rates["version"]) if applicable else RATE_TABLE[0]
+
+# Date field each billed collection is filtered on
+TIMESTAMP_FIELDS = {"documents": "processing_timestamp", "api_calls": "timestamp"}
+MAX_PAGE_SIZE = 500
+CSV_CHUNK_BYTES = int(os.getenv("CSV_CHUNK_BYTES", str(64 * 1024)))
+
+
+def _rate_expr(rate: str, timestamp_field: str) -> dict:
+    """Pick `rate` by the row's own month, the same way rates_for_month does."""
+    month = {"$dateToString": {"format": "%Y-%m", "date": f"${timestamp_field}"}}
+    by_version = sorted(RATE_TABLE, key=lambda rates: rates["version"], reverse=True)
+    return {"$switch": {
+        "branches": [
+            {"case": {"$gte": [month, rates["effective_from"]]}, "then": rates[rate]}
+            for rates in by_version
+        ],
+        "default": RATE_TABLE[0][rate],
+    }}
+
+
+def _document_charge_expr():
+    return {"$multiply": [{"$divide": ["$size", 1024]}, _rate_expr("document_rate_per_kb", TIMESTAMP_FIELDS["documents"])]}
+
+
+def _api_charge_expr():
+    return _rate_expr("api_rate", TIMESTAMP_FIELDS["api_calls"])
+
+
+def _date_match(collection: str, start: Optional[datetime], end: Optional[datetime]) -> list:
+    date_range = {}
+    if start is not None:
+        date_range["$gte"] = start
+    if end is not None:
+        date_range["$lt"] = end
+    return [{"$match": {TIMESTAMP_FIELDS[collection]: date_range}}] if date_range else []
+
+
+def _page(limit: Optional[int]) -> list:
+    return [{"$limit": limit}] if limit else []
+
+
+def _documents_pipeline(include_api_calls: bool, start: Optional[datetime] = None, end: Optional[datetime] = None, limit: Optional[int] = None) -> list:
+    project = {
+        "_id": 0,
+        "document_id": {"$toString": "$_id"},
+        "document_name": "$document_name",
+        "type": "$type",
+        "size": "$size",
+        "number_of_pages": {"$ifNull": ["$number_of_pages", None]},
+        "processing_timestamp": "$processing_timestamp",
+    }
+    pipeline = _date_match("documents", start, end) + [{"$sort": {"_id": 1}}] + _page(limit)
+    if include_api_calls:
+        project["processing_duration"] = {"$ifNull": ["$processing_duration", None]}
+        project["status"] = "$status"
+        project["charges"] = _document_charge_expr()
+        project["api_calls"] = "$api_calls"
+        pipeline.append({"$lookup": {
+            "from": "api_calls",
+            "localField": "_id",
+            "foreignField": "document_id",
+            "pipeline": [
+                {"$sort": {"_id": 1}},
+                {"$project": {
+                    "_id": 0,
+                    "api_request_id": {"$toString": "$_id"},
+                    "timestamp": "$timestamp",
+                    "api_endpoint": "$api_endpoint",
+                    "status": "$status",
+                }},
+            ],
+            "as": "api_calls",
+        }})
+    else:
+        project["charges"] = _document_charge_expr()
+    pipeline.append({"$project": project})
+    return pipeline
+
+
+def _api_calls_pipeline(start: Optional[datetime] = None, end: Optional[datetime] = None, limit: Optional[int] = None) -> list:
+    return _date_match("api_calls", start, end) + [{"$sort": {"_id": 1}}] + _page(limit) + [
+        {"$project": {
+            "_id": 0,
+            "api_request_id": {"$toString": "$_id"},
+            "timestamp": "$timestamp",
+            "api_endpoint": "$api_endpoint",
+            "status": "$status",
+            "charges": _api_charge_expr(),
+        }},
+    ]
+
+
+async def compute_billing_totals(user_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None, month: Optional[str] = None) -> Optional[dict]:
+    """Totals for a billing summary, grouped server-side without returning any rows.
+
+    With `month` (YYYY-MM) the counters come from that month's user statistics.
+    """
+    statistics = {"user_id": user_id, "month": month} if month else {"user_id": user_id}
+    pipeline = [
+        {"$match": statistics},
+        {"$limit": 1},
+        {"$lookup": {
+            "from": "documents",
+            "localField": "user_id",
+            "foreignField": "user_id",
+            "pipeline": _date_match("documents", start, end) + [
+                {"$group": {"_id": None, "charges": {"$sum": _document_charge_expr()}, "count": {"$sum": 1}}},
+            ],
+            "as": "documents",
+        }},
+        {"$lookup": {
+            "from": "api_calls",
+            "localField": "user_id",
+            "foreignField": "user_id",
+            "pipeline": _date_match("api_calls", start, end) + [
+                {"$group": {"_id": None, "charges": {"$sum": _api_charge_expr()}, "count": {"$sum": 1}}},
+            ],
+            "as": "api_calls",
+        }},
+        {"$project": {
+            "_id": 0,
+            "total_documents_processed": "$total_documents_processed",
+            "total_api_calls": "$total_api_calls",
+            "billing_period_start": "$billing_period_start",
+            "billing_period_end": "$billing_period_end",
+            "total_charges": {"$add": [{"$sum": "$documents.charges"}, {"$sum": "$api_calls.charges"}]},
+            "document_count": {"$sum": "$documents.count"},
+            "api_call_count": {"$sum": "$api_calls.count"},
+        }},
+    ]
+    results = await get_collection("user_statistics").aggregate(pipeline).to_list(length=1)
+    return results[0] if results else None
+
+
+async def compute_billing(user_id: str, include_document_api_calls: bool = True, start: Optional[datetime] = None, end: Optional[datetime] = None, month: Optional[str] = None) -> Optional[dict]:
+    """Build a user's billing summary; None when the user has no statistics.
+
+    The totals are grouped by Mongo and the rows read from their own cursors, so no
+    single result document has to hold every row (and hit the 16 MB limit).
+    """
+    billing_data = await compute_billing_totals(user_id, start, end, month)
+    if billing_data is None:
+        return None
+    billing_data["documents"] = [row async for row in iter_billing_rows(user_id, "documents", start=start, end=end, include_document_api_calls=include_document_api_calls)]
+    billing_data["api_calls"] = [row async for row in iter_billing_rows(user_id, "api_calls", start=start, end=end)]
+    return billing_data
+
+
+async def iter_billing_rows(user_id: str, section: str, after: Optional[str] = None, limit: Optional[int] = None, start: Optional[datetime] = None, end: Optional[datetime] = None, include_document_api_calls: bool = True):
+    """Yield billing rows for one section ("documents" or "api_calls") straight from the cursor.
+
+    Rows are ordered by _id; pass the last row's id as `after` to continue (keyset pagination).
+    """
+    match = {"user_id": user_id}
+    if after:
+        match["_id"] = {"$gt": ObjectId(after)}
+    if section == "documents":
+        pipeline = [{"$match": match}] + _documents_pipeline(include_document_api_calls, start, end, limit)
+    elif section == "api_calls":
+        pipeline = [{"$match": match}] + _api_calls_pipeline(start, end, limit)
+    else:
+        raise ValueError(f"Unknown billing section: {section}")
+
+    async for row in get_collection(section).aggregate(pipeline):
+        yield row
+
+
+async def billing_page(user_id: str, section: str, after: Optional[str], limit: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> dict:
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    items = [row async for row in iter_billing_rows(user_id, section, after, limit, start, end)]
+    id_field = "document_id" if section == "documents" else "api_request_id"
+    return {
+        "section": section,
+        "items": items,
+        "next_after": items[-1][id_field] if len(items) == limit else None,
+    }
+
+
+def _split_timestamp(timestamp) -> tuple:
+    if isinstance(timestamp, datetime):
+        return timestamp.strftime("%Y-%m-%d"), timestamp.strftime("%H:%M:%S")
+    return timestamp, ""
+
+
+async def iter_billing_csv(user_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Yield the billing CSV in chunks of about CSV_CHUNK_BYTES, reading rows straight from the cursors."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def take() -> str:
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.writerow(["API Endpoint", "Date", "Time", "Status", "Charges (Rs.)"])
+    async for api in iter_billing_rows(user_id, "api_calls", start=start, end=end):
+        writer.writerow([api["api_endpoint"], *_split_timestamp(api["timestamp"]), api["status"], f"{api['charges']:.2f}"])
+        if buffer.tell() >= CSV_CHUNK_BYTES:
+            yield take()
+
+    writer.writerow([])
+    writer.writerow(["Document Name", "Size (KB)", "Pages", "Date", "Time", "Charges (Rs.)"])
+    async for doc in iter_billing_rows(user_id, "documents", start=start, end=end, include_document_api_calls=False):
+        writer.writerow([
+            doc["document_name"], f"{doc['size'] / 1024:.2f}", doc["number_of_pages"],
+            *_split_timestamp(doc["processing_timestamp"]), f"{doc['charges']:.2f}"
+        ])
+        if buffer.tell() >= CSV_CHUNK_BYTES:
+            yield take()
+
+    yield take()
+
+
+async def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,147 @@
+import asyncio
+import calendar
+from datetime import datetime
+from typing import Optional
+from pymongo import UpdateOne
+from components.database import get_collection
+from components.eventBus import publish
+from components.billing import rates_for_month
+
+
+# One document per (user_id, month) with running totals, kept current as events are logged:
+# {user_id, month, rate_version, version, document_count, document_bytes,
+#  api_calls_total, api_calls: {endpoint: {status: count}}, charges: {documents, api_calls, total}}
+ROLLUP_COLLECTION = "billing_rollups"
+
+
+def month_of(timestamp: datetime) -> str:
+    return timestamp.strftime("%Y-%m")
+
+
+def month_range(month: str) -> tuple:
+    year, month_number = (int(part) for part in month.split("-"))
+    last_day = calendar.monthrange(year, month_number)[1]
+    start = datetime(year, month_number, 1)
+    end = datetime(year + (month_number == 12), month_number % 12 + 1, 1)
+    return start, end, datetime(year, month_number, last_day, 23, 59, 59)
+
+
+def _field_key(name: str) -> str:
+    # Endpoints become field names, which can't contain "." or start with "$"
+    return (name or "unknown").replace(".", "_").lstrip("$")
+
+
+def _rollup_update(user_id: str, month: str, increments: dict) -> UpdateOne:
+    rates = rates_for_month(month)
+    return UpdateOne(
+        {"user_id": user_id, "month": month},
+        {
+            "$inc": {**increments, "version": 1},
+            "$max": {"rate_version": rates["version"]},
+            "$set": {"updated_at": datetime.utcnow()},
+        },
+        upsert=True
+    )
+
+
+async def record_document(user_id: str, size: int, timestamp: datetime):
+    month = month_of(timestamp)
+    charge = size / 1024 * rates_for_month(month)["document_rate_per_kb"]
+    await publish(get_collection(ROLLUP_COLLECTION), _rollup_update(user_id, month, {
+        "document_count": 1,
+        "document_bytes": size,
+        "charges.documents": charge,
+        "charges.total": charge,
+    }))
+
+
+async def record_api_call(user_id: str, api_endpoint: str, status: str, timestamp: datetime, count: int = 1):
+    month = month_of(timestamp)
+    charge = rates_for_month(month)["api_rate"] * count
+    await publish(get_collection(ROLLUP_COLLECTION), _rollup_update(user_id, month, {
+        "api_calls_total": count,
+        f"api_calls.{_field_key(api_endpoint)}.{_field_key(status)}": count,
+        "charges.api_calls": charge,
+        "charges.total": charge,
+    }))
+
+
+async def get_monthly_rollup(user_id: str, month: str) -> Optional[dict]:
+    return await get_collection(ROLLUP_COLLECTION).find_one({"user_id": user_id, "month": month}, {"_id": 0})
+
+
+async def reconcile_rollups(user_id: Optional[str] = None, month: Optional[str] = None) -> int:
+    """Rebuild rollups from the raw documents and api_calls rows; returns the number rewritten."""
+    match = {"user_id": user_id} if user_id else {}
+    if month:
+        start, end, _ = month_range(month)
+
+    def pipeline(timestamp_field: str, group_key: dict, accumulators: dict) -> list:
+        stage_match = dict(match)
+        if month:
+            stage_match[timestamp_field] = {"$gte": start, "$lt": end}
+        month_expr = {"$dateToString": {"format": "%Y-%m", "date": f"${timestamp_field}"}}
+        return [
+            {"$match": stage_match},
+            {"$group": {"_id": {"user_id": "$user_id", "month": month_expr, **group_key}, **accumulators}},
+        ]
+
+    rollups = {}
+
+    def rollup_for(key: dict) -> dict:
+        rollup_key = (key["user_id"], key["month"])
+        if rollup_key not in rollups:
+            rates = rates_for_month(key["month"])
+            rollups[rollup_key] = {
+                "user_id": key["user_id"],
+                "month": key["month"],
+                "rate_version": rates["version"],
+                "document_count": 0,
+                "document_bytes": 0,
+                "api_calls_total": 0,
+                "api_calls": {},
+                "charges": {"documents": 0.0, "api_calls": 0.0, "total": 0.0},
+            }
+        return rollups[rollup_key]
+
+    documents = get_collection("documents").aggregate(pipeline("processing_timestamp", {}, {
+        "document_count": {"$sum": 1},
+        "document_bytes": {"$sum": "$size"},
+    }))
+    async for row in documents:
+        rollup = rollup_for(row["_id"])
+        rollup["document_count"] = row["document_count"]
+        rollup["document_bytes"] = row["document_bytes"]
+
+    api_calls = get_collection("api_calls").aggregate(pipeline("timestamp", {"api_endpoint": "$api_endpoint", "status": "$status"}, {
+        "count": {"$sum": 1},
+    }))
+    async for row in api_calls:
+        rollup = rollup_for(row["_id"])
+        endpoint = rollup["api_calls"].setdefault(_field_key(row["_id"].get("api_endpoint")), {})
+        endpoint[_field_key(row["_id"].get("status"))] = row["count"]
+        rollup["api_calls_total"] += row["count"]
+
+    operations = []
+    for rollup in rollups.values():
+        rates = rates_for_month(rollup["month"])
+        charges = rollup["charges"]
+        charges["documents"] = rollup["document_bytes"] / 1024 * rates["document_rate_per_kb"]
+        charges["api_calls"] = rollup["api_calls_total"] * rates["api_rate"]
+        charges["total"] = charges["documents"] + charges["api_calls"]
+        rollup["updated_at"] = datetime.utcnow()
+        # $inc keeps the version moving so invoices cached from the old numbers are not reused
+        operations.append(UpdateOne(
+            {"user_id": rollup["user_id"], "month": rollup["month"]},
+            {"$set": rollup, "$inc": {"version": 1}},
+            upsert=True
+        ))
+
+    if operations:
+        await get_collection(ROLLUP_COLLECTION).bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+if __name__ == "__main__":
+    # Reconcile job: python -m components.billingRollup
+    print(f"Reconciled {asyncio.run(reconcile_rollups())} monthly rollups")
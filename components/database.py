@@ -0,0 +1,87 @@
+import os
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# One Motor client per process, created in the FastAPI lifespan and shared by all components
+MONGODB_URL = os.getenv("MONGODB_URL")
+MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "audit_logs_db")
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+# zstd and snappy need the zstandard / python-snappy packages; zlib works out of the box
+MONGODB_COMPRESSORS = os.getenv("MONGODB_COMPRESSORS", "zlib")
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000"))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "30000"))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000"))
+
+# Indexes created at startup: collection -> [(keys, options)]
+INDEXES = {
+    "user_statistics": [
+        ([("user_id", ASCENDING), ("month", ASCENDING)], {"unique": True}),
+    ],
+    "billing_rollups": [
+        ([("user_id", ASCENDING), ("month", ASCENDING)], {"unique": True}),
+    ],
+    "documents": [
+        ([("user_id", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("user_id", ASCENDING), ("processing_timestamp", ASCENDING)], {}),
+    ],
+    "api_calls": [
+        ([("user_id", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("user_id", ASCENDING), ("timestamp", ASCENDING)], {}),
+        ([("document_id", ASCENDING)], {}),
+    ],
+    "extraction_jobs": [
+        # One job per (user, document, file, form) so client retries reuse it
+        ([("user_id", ASCENDING), ("doc_id", ASCENDING), ("sha256", ASCENDING), ("form_number", ASCENDING)], {"unique": True}),
+        ([("status", ASCENDING), ("created_at", ASCENDING)], {}),
+    ],
+}
+
+_client = None
+
+
+def connect() -> AsyncIOMotorClient:
+    global _client
+    if _client is None:
+        options = {
+            "maxPoolSize": MONGODB_MAX_POOL_SIZE,
+            "minPoolSize": MONGODB_MIN_POOL_SIZE,
+            "serverSelectionTimeoutMS": MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+            "connectTimeoutMS": MONGODB_CONNECT_TIMEOUT_MS,
+            "socketTimeoutMS": MONGODB_SOCKET_TIMEOUT_MS,
+            "maxIdleTimeMS": MONGODB_MAX_IDLE_TIME_MS,
+        }
+        if MONGODB_COMPRESSORS:
+            options["compressors"] = MONGODB_COMPRESSORS
+        _client = AsyncIOMotorClient(MONGODB_URL, **options)
+    return _client
+
+
+def close():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+def get_database():
+    # Connects lazily so scripts and the standalone upload app work without the lifespan hook
+    return connect()[MONGODB_DATABASE]
+
+
+def get_collection(name: str):
+    return get_database().get_collection(name)
+
+
+async def ensure_indexes():
+    for name, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await get_collection(name).create_index(keys, **options)
+            except Exception as e:
+                # e.g. existing duplicates blocking a unique index; the app still starts
+                print(f"Could not create index {keys} on {name}: {e}")
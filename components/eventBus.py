@@ -0,0 +1,199 @@
+import asyncio
+import os
+import time
+from pymongo import InsertOne
+from pymongo.errors import PyMongoError, BulkWriteError
+
+
+# Audit/usage writes are queued here and flushed by one background writer
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "200"))
+EVENT_FLUSH_MS = int(os.getenv("EVENT_FLUSH_MS", "250"))
+# publish() waits once this many events are pending, which slows producers down
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "10000"))
+# Events carry billable data, so a failed write is retried with exponential backoff
+# (EVENT_RETRY_BASE_MS, doubling, capped at EVENT_RETRY_MAX_MS) before it is given up
+EVENT_MAX_ATTEMPTS = int(os.getenv("EVENT_MAX_ATTEMPTS", "8"))
+EVENT_RETRY_BASE_MS = int(os.getenv("EVENT_RETRY_BASE_MS", "500"))
+EVENT_RETRY_MAX_MS = int(os.getenv("EVENT_RETRY_MAX_MS", "30000"))
+
+_queue = None
+_writer = None
+_stop = object()
+# Failed events waiting for their next attempt, and when that attempt is due
+_retry = []
+_retry_at = 0.0
+_stats = {"published": 0, "flushed": 0, "batches": 0, "errors": 0, "retried": 0, "dropped": 0}
+
+# Mongo error code for a duplicate key: an insert retried after it already landed
+DUPLICATE_KEY = 11000
+
+
+async def publish(collection, operation):
+    """Queue a pymongo write (InsertOne, UpdateOne, ...) for the next bulk flush."""
+    if _writer is None or _writer.done():
+        # Bus not running (scripts, standalone apps, or the writer died): write straight away
+        await collection.bulk_write([operation])
+        return
+    _stats["published"] += 1
+    await _queue.put(("op", collection, operation, 0))
+
+
+async def publish_task(coro_func, *args, **kwargs):
+    """Queue bookkeeping that can't be expressed as a single bulk operation."""
+    if _writer is None or _writer.done():
+        await coro_func(*args, **kwargs)
+        return
+    _stats["published"] += 1
+    await _queue.put(("task", coro_func, (args, kwargs), 0))
+
+
+async def _bulk_write(collection, items: list) -> list:
+    """Write the ops of one collection in order; returns the items that still need writing."""
+    remaining = items
+    while remaining:
+        try:
+            await collection.bulk_write([item[2] for item in remaining], ordered=True)
+            return []
+        except BulkWriteError as e:
+            if not e.details.get("writeErrors"):
+                # Only write concern errors: the writes were applied but not acknowledged as
+                # asked. Retrying would apply the $inc updates twice
+                print(f"Write concern error flushing {len(remaining)} events to {collection.full_name}: {e.details.get('writeConcernErrors')}")
+                return []
+            # Ordered: everything before the first error was applied
+            error = e.details["writeErrors"][0]
+            index = error["index"]
+            if error.get("code") == DUPLICATE_KEY and isinstance(remaining[index][2], InsertOne):
+                remaining = remaining[index + 1:]
+                continue
+            print(f"Error flushing {len(remaining) - index} events to {collection.full_name}: {error.get('errmsg')}")
+            return remaining[index:]
+        except PyMongoError as e:
+            print(f"Error flushing {len(remaining)} events to {collection.full_name}: {e}")
+            return remaining
+    return []
+
+
+async def _flush(batch: list):
+    global _retry_at
+    operations = {}
+    tasks = []
+    for item in batch:
+        if item[0] == "op":
+            collection, items = operations.setdefault(item[1].full_name, (item[1], []))
+            items.append(item)
+        else:
+            tasks.append(item)
+
+    failed = []
+    for collection, items in operations.values():
+        failed.extend(await _bulk_write(collection, items))
+
+    for item in tasks:
+        coro_func, (args, kwargs) = item[1], item[2]
+        try:
+            await coro_func(*args, **kwargs)
+        except PyMongoError as e:
+            print(f"Error running deferred {coro_func.__name__}: {e}")
+            failed.append(item)
+        except Exception as e:
+            # Not a database problem (e.g. the document was deleted); retrying won't help
+            _stats["errors"] += 1
+            print(f"Error running deferred {coro_func.__name__}: {e}")
+
+    attempts = 0
+    for kind, target, payload, tries in failed:
+        _stats["errors"] += 1
+        if tries + 1 >= EVENT_MAX_ATTEMPTS:
+            _stats["dropped"] += 1
+            print(f"Dropping {kind} event for {getattr(target, 'full_name', getattr(target, '__name__', target))} after {tries + 1} attempts: {payload}")
+            continue
+        _stats["retried"] += 1
+        _retry.append((kind, target, payload, tries + 1))
+        attempts = max(attempts, tries + 1)
+    if attempts:
+        delay_ms = min(EVENT_RETRY_BASE_MS * 2 ** (attempts - 1), EVENT_RETRY_MAX_MS)
+        _retry_at = time.monotonic() + delay_ms / 1000
+
+    _stats["flushed"] += len(batch) - len(failed)
+    _stats["batches"] += 1
+
+
+async def _flush_safely(batch: list):
+    # An unexpected error must not end the writer, or every later publish() would queue forever
+    try:
+        await _flush(batch)
+    except Exception as e:
+        _stats["errors"] += 1
+        print(f"Error flushing {len(batch)} events: {e}")
+
+
+def _take_retries() -> list:
+    batch = list(_retry)
+    _retry.clear()
+    return batch
+
+
+async def _run_writer():
+    stopping = False
+    while not stopping:
+        if _retry and time.monotonic() >= _retry_at:
+            await _flush_safely(_take_retries())
+            continue
+        try:
+            if _retry:
+                item = await asyncio.wait_for(_queue.get(), max(_retry_at - time.monotonic(), 0))
+            else:
+                item = await _queue.get()
+        except asyncio.TimeoutError:
+            continue
+        if item is _stop:
+            break
+        batch = [item]
+        deadline = time.monotonic() + EVENT_FLUSH_MS / 1000
+        while len(batch) < EVENT_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is _stop:
+                stopping = True
+                break
+            batch.append(item)
+        await _flush_safely(batch)
+
+
+async def start_event_bus():
+    global _queue, _writer
+    if _writer is None:
+        _queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        _writer = asyncio.create_task(_run_writer())
+
+
+async def stop_event_bus():
+    """Flush everything still queued and stop the writer."""
+    global _queue, _writer
+    if _writer is None:
+        return
+    if not _writer.done():
+        await _queue.put(_stop)
+    await asyncio.gather(_writer, return_exceptions=True)
+    # Anything published while stopping, and events still waiting for a retry,
+    # get one last attempt; whatever fails now is reported as lost
+    pending = _take_retries()
+    while not _queue.empty():
+        pending.append(_queue.get_nowait())
+    _writer = None
+    if pending:
+        await _flush_safely(pending)
+    for kind, target, payload, tries in _take_retries():
+        _stats["dropped"] += 1
+        print(f"Lost {kind} event at shutdown: {payload}")
+    _queue = None
+
+
+def get_event_bus_stats() -> dict:
+    return {**_stats, "pending": _queue.qsize() if _queue is not None else 0, "waiting_retry": len(_retry)}
@@ -0,0 +1,108 @@
+import asyncio
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextvars import ContextVar
+from typing import Optional
+
+
+# Pool used for blocking work (PDF processing, sync analysis calls).
+# EXTRACTION_POOL_KIND can be "thread" (default) or "process".
+POOL_KIND = os.getenv("EXTRACTION_POOL_KIND", "thread").lower()
+POOL_SIZE = int(os.getenv("EXTRACTION_POOL_SIZE", "8"))
+
+# Maximum number of analyses running at the same time for one model id.
+# EXTRACTION_MODEL_LIMITS overrides it per model, e.g. "Form2_Neural=2,voter_neural=4"
+DEFAULT_MODEL_CONCURRENCY = int(os.getenv("EXTRACTION_MODEL_CONCURRENCY", "4"))
+
+
+def _parse_model_limits(raw: Optional[str]) -> dict:
+    limits = {}
+    for item in (raw or "").split(","):
+        if "=" not in item:
+            continue
+        model_id, limit = item.split("=", 1)
+        limits[model_id.strip()] = int(limit)
+    return limits
+
+
+MODEL_LIMITS = _parse_model_limits(os.getenv("EXTRACTION_MODEL_LIMITS"))
+
+_pool = None
+_semaphores = {}
+# Model ids whose slot the current task is running under (see holds_slot)
+_held_models = ContextVar("held_models", default=frozenset())
+_stats = defaultdict(lambda: {"queued": 0, "running": 0, "completed": 0, "failed": 0})
+
+
+def start_executor():
+    global _pool
+    if _pool is None:
+        if POOL_KIND == "process":
+            _pool = ProcessPoolExecutor(max_workers=POOL_SIZE)
+        else:
+            _pool = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="extraction")
+    return _pool
+
+
+def shutdown_executor():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+def _get_semaphore(model_id: str) -> asyncio.Semaphore:
+    if model_id not in _semaphores:
+        _semaphores[model_id] = asyncio.Semaphore(MODEL_LIMITS.get(model_id, DEFAULT_MODEL_CONCURRENCY))
+    return _semaphores[model_id]
+
+
+async def _run_capped(model_id: str, make_awaitable):
+    stats = _stats[model_id]
+    semaphore = _get_semaphore(model_id)
+    stats["queued"] += 1
+    try:
+        await semaphore.acquire()
+    finally:
+        stats["queued"] -= 1
+
+    stats["running"] += 1
+    token = _held_models.set(_held_models.get() | {model_id})
+    try:
+        result = await make_awaitable()
+    except Exception:
+        stats["failed"] += 1
+        raise
+    finally:
+        _held_models.reset(token)
+        stats["running"] -= 1
+        semaphore.release()
+    stats["completed"] += 1
+    return result
+
+
+async def submit(model_id: str, func, *args):
+    """Run a blocking call on the worker pool, capped per model id."""
+    loop = asyncio.get_running_loop()
+    return await _run_capped(model_id, lambda: loop.run_in_executor(start_executor(), func, *args))
+
+
+async def run(model_id: str, coro_func, *args):
+    """Await a coroutine analysis on the event loop, capped per model id."""
+    return await _run_capped(model_id, lambda: coro_func(*args))
+
+
+def holds_slot(model_id: str) -> bool:
+    """True inside a run()/submit() for model_id, i.e. the caller already occupies one of its slots."""
+    return model_id in _held_models.get()
+
+
+def get_executor_stats() -> dict:
+    return {
+        "pool_kind": POOL_KIND,
+        "pool_size": POOL_SIZE,
+        "queue_depth": sum(s["queued"] for s in _stats.values()),
+        "running": sum(s["running"] for s in _stats.values()),
+        "models": {model_id: dict(s) for model_id, s in _stats.items()},
+    }
@@ -0,0 +1,63 @@
+import json
+from datetime import date, datetime
+from typing import Any, Optional
+import orjson
+
+
+class FieldResult:
+    """One extracted field. Serialized as [value, confidence], the shape clients already read.
+
+    The location stays server-side: region is an index into the FieldGeometry shared by
+    all fields of the result, so each field holds an int rather than its own coordinates.
+    """
+
+    __slots__ = ("value", "confidence", "geometry", "region")
+
+    def __init__(self, value: Any, confidence: Optional[float], geometry=None, region: int = -1):
+        self.value = value
+        self.confidence = confidence
+        self.geometry = geometry
+        self.region = region
+
+    @property
+    def page(self) -> Optional[int]:
+        if self.geometry is None or self.region < 0:
+            return None
+        return int(self.geometry.pages[self.region])
+
+    @property
+    def bbox(self) -> Optional[list]:
+        """[x0, y0, x1, y1] in PDF points from the top-left corner."""
+        if self.geometry is None or self.region < 0:
+            return None
+        return self.geometry.bboxes[self.region].tolist()
+
+    def as_list(self) -> list:
+        return [self.value, self.confidence]
+
+    def __repr__(self) -> str:
+        return f"FieldResult({self.value!r}, {self.confidence!r}, page={self.page!r})"
+
+
+def encode_default(value):
+    # Called by the encoder only for objects it can't serialize itself, so the
+    # result tree is never copied just to convert fields and dates
+    if isinstance(value, FieldResult):
+        return value.as_list()
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(output) -> bytes:
+    return orjson.dumps(output, default=encode_default)
+
+
+def dumps_pretty(output) -> str:
+    # For the sync scripts, which have always printed indented JSON
+    return json.dumps(output, indent=4, default=encode_default)
+
+
+def to_plain(output):
+    """JSON-compatible copy of a result, for storing it in Mongo."""
+    return orjson.loads(dumps(output))
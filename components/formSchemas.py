@@ -0,0 +1,95 @@
+import glob
+import json
+import os
+
+
+# Form definitions live in forms/*.json; adding a form only needs a new file there
+FORMS_DIR = os.getenv("FORMS_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "forms"))
+
+# Field names returned by Azure are "|"-separated paths into the field tree
+PATH_SEPARATOR = "|"
+
+
+class FormSchema:
+    """A form definition with its field tree compiled into a flat build plan."""
+
+    def __init__(self, definition: dict):
+        self.form_number = definition["form_number"]
+        self.name = definition["name"]
+        self.neural_model_id = definition["neural_model_id"]
+        self.template_model_id = definition["template_model_id"]
+        self.credentials = definition.get("credentials", "primary")
+        # Each step is (parent container index, key, is_container)
+        self._plan = []
+        self._container_count = 1
+        # Field path -> (parent container index, key)
+        self._slots = {}
+        self._compile(definition["fields"], 0, ())
+
+    def _compile(self, tree: dict, parent_index: int, prefix: tuple):
+        for key, value in tree.items():
+            path = prefix + (key,)
+            if isinstance(value, dict):
+                self._plan.append((parent_index, key, True))
+                child_index = self._container_count
+                self._container_count += 1
+                self._compile(value, child_index, path)
+            else:
+                self._plan.append((parent_index, key, False))
+                self._slots[PATH_SEPARATOR.join(path)] = (parent_index, key)
+
+    def new_storage(self):
+        """Build an empty field tree and the slot table pointing into it."""
+        containers = [{}]
+        for parent_index, key, is_container in self._plan:
+            if is_container:
+                child = {}
+                containers[parent_index][key] = child
+                containers.append(child)
+            else:
+                containers[parent_index][key] = []
+        slots = {path: (containers[parent_index], key) for path, (parent_index, key) in self._slots.items()}
+        return containers[0], slots
+
+
+def set_field(storage: dict, slots: dict, name: str, value):
+    slot = slots.get(name)
+    if slot is not None:
+        parent, key = slot
+        parent[key] = value
+        return
+    # Field not declared in the schema: create its path like before
+    keys_list = name.split(PATH_SEPARATOR)
+    temp_dict = storage
+    for k in keys_list[:-1]:
+        temp_dict = temp_dict.setdefault(k, {})
+    temp_dict[keys_list[-1]] = value
+
+
+def iter_fields(storage: dict, prefix: tuple = ()):
+    """Yield (field path, value) for every filled leaf of a field tree."""
+    for key, value in storage.items():
+        path = prefix + (key,)
+        if isinstance(value, dict):
+            yield from iter_fields(value, path)
+        elif value:
+            yield PATH_SEPARATOR.join(path), value
+
+
+def load_form_schemas(directory: str = FORMS_DIR) -> dict:
+    schemas = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            schema = FormSchema(json.load(f))
+        schemas[schema.form_number] = schema
+    return schemas
+
+
+FORM_SCHEMAS = load_form_schemas()
+
+
+def get_form_schema(form_number: int) -> FormSchema:
+    schema = FORM_SCHEMAS.get(form_number)
+    if schema is None:
+        raise ValueError(f"Unknown form number: {form_number}")
+    return schema
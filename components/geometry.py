@@ -0,0 +1,117 @@
+from typing import Iterable, Optional
+import numpy as np
+
+
+# Azure reports polygons in inches from the top-left corner of the page; PDF space is in points
+POINTS_PER_INCH = 72
+
+
+class FieldGeometry:
+    """All bounding regions of a set of fields, packed into flat NumPy arrays.
+
+    Region i belongs to names[field_index[i]], sits on pages[i] (1-based) and owns
+    points[offsets[i]:offsets[i + 1]], in PDF points from the top-left corner.
+    bboxes[i] is [x0, y0, x1, y1] in the same space.
+    """
+
+    __slots__ = ("names", "field_index", "pages", "offsets", "points", "bboxes")
+
+    def __init__(self, names: list, field_index, pages, offsets, points):
+        self.names = names
+        self.field_index = np.asarray(field_index, dtype=np.int64)
+        self.pages = np.asarray(pages, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(self.pages):
+            starts = self.offsets[:-1]
+            self.bboxes = np.column_stack([
+                np.minimum.reduceat(self.points, starts, axis=0),
+                np.maximum.reduceat(self.points, starts, axis=0),
+            ])
+        else:
+            self.bboxes = np.empty((0, 4))
+
+    @classmethod
+    def from_fields(cls, fields: Iterable) -> "FieldGeometry":
+        """Build from (name, DocumentField) pairs in one pass over the Azure objects."""
+        names, field_index, pages, offsets, coords = [], [], [], [0], []
+        for name, field in fields:
+            index = len(names)
+            names.append(name)
+            for region in field.bounding_regions or []:
+                polygon = region.polygon or []
+                if not polygon:
+                    continue
+                field_index.append(index)
+                pages.append(region.page_number)
+                for point in polygon:
+                    coords.append(point.x)
+                    coords.append(point.y)
+                offsets.append(offsets[-1] + len(polygon))
+        points = np.array(coords, dtype=np.float64) * POINTS_PER_INCH
+        return cls(names, field_index, pages, offsets, points)
+
+    @classmethod
+    def from_result(cls, result) -> "FieldGeometry":
+        return cls.from_fields(
+            (name, field)
+            for document in result.documents
+            for name, field in document.fields.items()
+        )
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def select(self, mask) -> np.ndarray:
+        """Indices of the regions whose field matches a per-field boolean mask."""
+        return np.flatnonzero(np.asarray(mask, dtype=bool)[self.field_index]) if len(self) else np.empty(0, dtype=np.int64)
+
+    def regions_where(self, predicate) -> np.ndarray:
+        return self.select([predicate(name) for name in self.names])
+
+    def signature_indices(self) -> np.ndarray:
+        return self.regions_where(lambda name: "signature" in name.lower())
+
+    def first_regions(self) -> np.ndarray:
+        """Index of each field's first region, -1 for fields without one."""
+        first = np.full(len(self.names), -1, dtype=np.int64)
+        if len(self):
+            # field_index is non-decreasing, so the first occurrence is the first region
+            fields, starts = np.unique(self.field_index, return_index=True)
+            first[fields] = starts
+        return first
+
+    def region_points(self, index: int) -> np.ndarray:
+        return self.points[self.offsets[index]:self.offsets[index + 1]]
+
+    def as_regions(self, indices: Optional[Iterable] = None) -> list:
+        """[{"page", "points"}] dicts, the format stored with documents (see components.signatureCrop)."""
+        indices = range(len(self)) if indices is None else indices
+        return [
+            {"page": int(self.pages[i]), "points": self.region_points(i).tolist()}
+            for i in indices
+        ]
+
+    def pages_of(self, names: Iterable) -> list:
+        """Sorted pages touched by the given fields."""
+        wanted = set(names)
+        indices = self.select([name in wanted for name in self.names])
+        return sorted(set(self.pages[indices].tolist()))
+
+
+def bbox(points) -> np.ndarray:
+    """[x0, y0, x1, y1] of a polygon given as [[x, y], ...]."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return np.concatenate([points.min(axis=0), points.max(axis=0)])
+
+
+def to_pdf_space(box, page_left: float, page_top: float) -> np.ndarray:
+    """Flip a top-left based [x0, y0, x1, y1] box into PDF space (origin bottom-left)."""
+    x0, y0, x1, y1 = np.asarray(box, dtype=np.float64)
+    return np.array([page_left + x0, page_top - y1, page_left + x1, page_top - y0])
+
+
+def edge_margins(box, page_width: float, page_height: float) -> np.ndarray:
+    """Distance to cut from each edge (left, bottom, right, top) to keep only the box."""
+    x0, y0, x1, y1 = np.asarray(box, dtype=np.float64)
+    return np.maximum([x0, page_height - y1, page_width - x1, y0], 0)
@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from typing import Optional
+import PyPDF2
+from fastapi import UploadFile, HTTPException
+
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "50"))
+# Upper bound on the documents taken from one zip archive
+MAX_ZIP_ENTRIES = int(os.getenv("MAX_ZIP_ENTRIES", "500"))
+
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# Page tree nodes look like << /Type /Pages /Kids [...] /Count 12 >>, keys in any order
+_PAGES_COUNT_PATTERNS = [
+    re.compile(rb"/Type\s*/Pages\b[^>]*?/Count\s+(\d+)"),
+    re.compile(rb"/Count\s+(\d+)[^>]*?/Type\s*/Pages\b"),
+]
+# Bytes kept from the previous chunk so a dictionary split across chunks is still seen
+_SCAN_OVERLAP = 4096
+
+
+@dataclass
+class IngestedFile:
+    filename: str
+    content_type: Optional[str]
+    path: Optional[str]
+    size: int
+    sha256: str
+    pages: int
+
+
+class PageCounter:
+    """Finds the page count of a PDF from its page tree while the bytes stream past.
+
+    The largest /Count is only trusted for files written in one go. A file saved with
+    incremental updates (or linearized) has several %%EOF markers and may still hold
+    superseded page trees, so count is None for it and the caller parses the file.
+    """
+
+    def __init__(self):
+        self.is_pdf = None
+        self._count = None
+        self.eof_markers = 0
+        self._tail = b""
+
+    @property
+    def count(self):
+        return self._count if self.eof_markers <= 1 else None
+
+    def feed(self, chunk: bytes):
+        if self.is_pdf is None:
+            self.is_pdf = chunk.lstrip()[:5] == b"%PDF-"
+        if not self.is_pdf:
+            return
+        # The 4 carried-over bytes can't hold a whole marker, so none is counted twice
+        self.eof_markers += (self._tail[-4:] + chunk).count(b"%%EOF")
+        window = self._tail + chunk
+        for pattern in _PAGES_COUNT_PATTERNS:
+            for match in pattern.finditer(window):
+                # The root of the page tree carries the largest count
+                count = int(match.group(1))
+                if self._count is None or count > self._count:
+                    self._count = count
+        self._tail = window[-_SCAN_OVERLAP:]
+
+
+def count_pdf_pages(path: str) -> int:
+    # Fallback for PDFs whose page tree sits inside compressed object streams
+    with open(path, "rb") as f:
+        return count_stream_pages(f)
+
+
+def count_stream_pages(stream) -> int:
+    stream.seek(0)
+    return len(PyPDF2.PdfReader(stream).pages)
+
+
+async def ingest_upload(file: UploadFile, save: bool = True) -> IngestedFile:
+    """Stream an upload in chunks, enforcing the size limit and hashing as it goes.
+
+    With save=True the bytes land in a unique file under UPLOAD_DIR which the
+    caller is responsible for removing.
+    """
+    max_bytes = MAX_UPLOAD_MB * 1024 * 1024
+    sha256 = hashlib.sha256()
+    counter = PageCounter()
+    size = 0
+
+    path = None
+    out = None
+    if save:
+        suffix = os.path.splitext(file.filename or "")[1]
+        fd, path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=suffix)
+        out = os.fdopen(fd, "wb")
+
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"File exceeds the {MAX_UPLOAD_MB} MB upload limit")
+            sha256.update(chunk)
+            counter.feed(chunk)
+            if out is not None:
+                out.write(chunk)
+    except BaseException:
+        if out is not None:
+            out.close()
+            os.remove(path)
+        raise
+    if out is not None:
+        out.close()
+
+    if not counter.is_pdf:
+        pages = 1
+    elif counter.count is not None:
+        pages = counter.count
+    elif path is not None:
+        # Full parse of what may be a large scan: keep it off the event loop
+        pages = await asyncio.to_thread(count_pdf_pages, path)
+    else:
+        pages = await asyncio.to_thread(count_stream_pages, file.file)
+
+    return IngestedFile(
+        filename=file.filename,
+        content_type=file.content_type,
+        path=path,
+        size=size,
+        sha256=sha256.hexdigest(),
+        pages=pages,
+    )
+
+
+def discard(ingested: Optional[IngestedFile]):
+    if ingested is not None and ingested.path and os.path.exists(ingested.path):
+        os.remove(ingested.path)
+
+
+def is_zip(ingested: IngestedFile) -> bool:
+    return (ingested.content_type in ("application/zip", "application/x-zip-compressed")
+            or (ingested.filename or "").lower().endswith(".zip"))
+
+
+def _extract_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> IngestedFile:
+    max_bytes = MAX_UPLOAD_MB * 1024 * 1024
+    sha256 = hashlib.sha256()
+    counter = PageCounter()
+    size = 0
+
+    suffix = os.path.splitext(info.filename)[1]
+    fd, path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as out, archive.open(info) as member:
+            while True:
+                chunk = member.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                # Checked on the bytes actually read, not the size the archive claims
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"{info.filename} exceeds the {MAX_UPLOAD_MB} MB upload limit")
+                sha256.update(chunk)
+                counter.feed(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    if not counter.is_pdf:
+        pages = 1
+    elif counter.count is not None:
+        pages = counter.count
+    else:
+        pages = count_pdf_pages(path)
+
+    return IngestedFile(
+        filename=os.path.basename(info.filename),
+        content_type=mimetypes.guess_type(info.filename)[0] or "application/octet-stream",
+        path=path,
+        size=size,
+        sha256=sha256.hexdigest(),
+        pages=pages,
+    )
+
+
+def extract_zip(ingested: IngestedFile) -> list:
+    """Unpack an ingested zip into one IngestedFile per document (blocking; run it off the loop).
+
+    Directories and hidden entries are skipped. On failure every file written so far is removed.
+    """
+    extracted = []
+    try:
+        with zipfile.ZipFile(ingested.path) as archive:
+            members = [
+                info for info in archive.infolist()
+                if not info.is_dir() and not os.path.basename(info.filename).startswith(".")
+            ]
+            if len(members) > MAX_ZIP_ENTRIES:
+                raise HTTPException(status_code=413, detail=f"Zip holds more than {MAX_ZIP_ENTRIES} documents")
+            for info in members:
+                extracted.append(_extract_member(archive, info))
+    except zipfile.BadZipFile:
+        for item in extracted:
+            discard(item)
+        raise HTTPException(status_code=400, detail=f"{ingested.filename} is not a valid zip archive")
+    except BaseException:
+        for item in extracted:
+            discard(item)
+        raise
+    return extracted
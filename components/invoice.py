@@ -0,0 +1,139 @@
+import io
+import os
+from datetime import datetime
+from PIL import Image as PILImage
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Image, Spacer
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from components.resultCache import LRUCache
+
+
+LOGO_PATH = os.getenv("INVOICE_LOGO_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "aeroqube-logo.webp"))
+LOGO_WIDTH = 4 * inch
+LOGO_HEIGHT = 1.2 * inch
+# Rendered invoices kept in memory, keyed by (user_id, month, rollup version)
+INVOICE_CACHE_ENTRIES = int(os.getenv("INVOICE_CACHE_ENTRIES", "256"))
+
+
+def _load_logo() -> bytes:
+    # The source logo is a very large RGBA WebP. Flatten and shrink it once to a 300 dpi JPEG,
+    # which ReportLab embeds as-is instead of decoding and recompressing it on every invoice.
+    with PILImage.open(LOGO_PATH) as image:
+        image = image.convert("RGBA")
+        background = PILImage.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        background.thumbnail((int(LOGO_WIDTH / inch * 300), int(LOGO_HEIGHT / inch * 300)))
+        out = io.BytesIO()
+        background.save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+LOGO_JPEG = _load_logo()
+
+styles = getSampleStyleSheet()
+title_style = ParagraphStyle('TitleStyle', fontSize=16, textColor=colors.HexColor('#2E86C1'), alignment=1, spaceAfter=12)
+
+user_info_table_style = TableStyle([
+    ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+    ('ALIGN', (1, 0), (1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#2E86C1')),
+    ('TOPPADDING', (0, 0), (-1, -1), 5),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
+])
+
+doc_table_style = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2E86C1')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 11),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.lightgrey),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.whitesmoke, colors.lightgrey]),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+    ('TOPPADDING', (0, 0), (-1, 0), 8),
+])
+
+api_table_style = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2E86C1')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 11),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.whitesmoke, colors.lightgrey]),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+    ('TOPPADDING', (0, 0), (-1, 0), 8),
+])
+
+invoice_cache = LRUCache(INVOICE_CACHE_ENTRIES)
+
+
+def render_invoice(billing_data: dict, user_email: str) -> bytes:
+    """Render the monthly billing statement into memory and return the PDF bytes."""
+    buffer = io.BytesIO()
+    pdf = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=20, leftMargin=20, topMargin=40, bottomMargin=40)
+    elements = []
+
+    # Add company logo
+    logo = Image(io.BytesIO(LOGO_JPEG), LOGO_WIDTH, LOGO_HEIGHT)
+    logo.hAlign = 'CENTER'
+    elements.append(logo)
+
+    # Title with enhanced styling
+    elements.append(Paragraph("Monthly Billing Statement", title_style))
+
+    # User Information Section in two-column format
+    user_info_table_data = [
+        ["User:", user_email],
+        ["Billing Date:", datetime.now().strftime("%Y-%m-%d")],
+        ["Billing Period:", f"{billing_data['billing_period_start']} - {billing_data['billing_period_end']}"],
+        ["Total Documents Processed:", billing_data['total_documents_processed']],
+        ["Total API Calls:", billing_data['total_api_calls']],
+        ["Total Charges:", f"Rs. {billing_data['total_charges']:.2f}"],
+    ]
+    user_info_table = Table(user_info_table_data, colWidths=[2.5 * inch, 3.5 * inch])
+    user_info_table.setStyle(user_info_table_style)
+    elements.append(user_info_table)
+    elements.append(Spacer(1, 12))
+
+    # Document Summary Table
+    elements.append(Paragraph("<b>Document Summary:</b>", styles['Heading2']))
+    doc_table_data = [["Document Name", "Size (KB)", "Pages", "Date Processed", "Charges (Rs.)"]]
+    for doc in billing_data['documents']:
+        doc_table_data.append([
+            doc['document_name'], f"{doc['size'] / 1024:.2f}",
+            doc['number_of_pages'], doc['processing_timestamp'],
+            f"Rs. {doc['charges']:.2f}"
+        ])
+    doc_table = Table(doc_table_data, colWidths=[2*inch, 1*inch, 1*inch, 2*inch, 1.5*inch])
+    doc_table.setStyle(doc_table_style)
+    elements.append(doc_table)
+
+    # API Call Summary Table
+    elements.append(Paragraph("<b>API Call Summary:</b>", styles['Heading2']))
+    api_table_data = [["API Endpoint", "Date", "Charges (Rs.)"]]
+    for api in billing_data['api_calls']:
+        api_table_data.append([
+            api['api_endpoint'], api['timestamp'],
+            f"Rs. {api['charges']:.2f}"
+        ])
+    api_table = Table(api_table_data, colWidths=[3*inch, 2*inch, 1.5*inch])
+    api_table.setStyle(api_table_style)
+    elements.append(api_table)
+
+    # Billing Summary Section
+    elements.append(Paragraph("<b>Billing Summary:</b>", styles['Heading2']))
+    summary = f"""
+    <b>Total Documents Processed:</b> {billing_data['total_documents_processed']}<br/>
+    <b>Total API Calls:</b> {billing_data['total_api_calls']}<br/>
+    <b>Total Charges:</b> Rs. {billing_data['total_charges']:.2f}<br/>
+    """
+    elements.append(Paragraph(summary, styles['Normal']))
+
+    pdf.build(elements)
+    return buffer.getvalue()
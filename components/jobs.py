@@ -0,0 +1,233 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from bson import ObjectId
+from pymongo import ReturnDocument
+import model as Model
+from components.database import get_collection
+from components.executor import run
+from components.fieldResult import to_plain
+from components.eventBus import publish_task
+from components.ingest import IngestedFile
+from components.logApi import log_api_call
+from components.logAudit import log_audit_event
+from components.logDocument import update_document_processing
+from components.userStatistics import update_user_statistics
+
+
+# Extraction jobs live next to `documents`:
+# {_id, user_id, doc_id, sha256, form_number, filename, file_path, status, attempts,
+#  created_at, started_at, finished_at, lease_expires_at, processing_duration, result, error}
+JOBS_COLLECTION = "extraction_jobs"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# A running job whose lease has expired (worker died mid-analysis) is picked up again
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "600"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+_workers = []
+_wakeup = None
+
+
+async def create_job(user_id: str, doc_id: str, form_number: int, ingested: IngestedFile) -> dict:
+    """Queue an extraction for an ingested upload and return the job document.
+
+    A retry of the same (user, doc_id, file, form) returns the existing job instead
+    of starting the analysis again; only a failed job is re-queued.
+    """
+    now = datetime.utcnow()
+    key = {"user_id": user_id, "doc_id": doc_id, "sha256": ingested.sha256, "form_number": form_number}
+    job = await get_collection(JOBS_COLLECTION).find_one_and_update(
+        key,
+        {"$setOnInsert": {
+            "filename": ingested.filename,
+            "file_path": ingested.path,
+            "status": "queued",
+            "attempts": 0,
+            "created_at": now,
+        }},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    if job["file_path"] != ingested.path:
+        if job["status"] != "failed":
+            return job
+        # Failed before: run it again on the freshly uploaded copy
+        job = await get_collection(JOBS_COLLECTION).find_one_and_update(
+            {"_id": job["_id"], "status": "failed"},
+            {
+                "$set": {"file_path": ingested.path, "status": "queued", "attempts": 0, "created_at": now},
+                "$unset": {"error": "", "finished_at": "", "lease_expires_at": ""},
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None or job["file_path"] != ingested.path:
+            # Another retry re-queued it first
+            return await get_collection(JOBS_COLLECTION).find_one(key)
+
+    if _wakeup is not None:
+        _wakeup.set()
+    return job
+
+
+def owns_file(job: dict, ingested: IngestedFile) -> bool:
+    # The caller removes its upload unless the job now points at it
+    return job is not None and job.get("file_path") == ingested.path
+
+
+async def get_job(user_id: str, job_id: str) -> Optional[dict]:
+    if not ObjectId.is_valid(job_id):
+        return None
+    return await get_collection(JOBS_COLLECTION).find_one({"_id": ObjectId(job_id), "user_id": user_id})
+
+
+async def latest_job_result(user_id: str, doc_id: str) -> Optional[dict]:
+    job = await get_collection(JOBS_COLLECTION).find_one(
+        {"user_id": user_id, "doc_id": doc_id, "status": "done"},
+        {"result": 1},
+        sort=[("finished_at", -1)]
+    )
+    return job["result"] if job else None
+
+
+async def store_job_result(user_id: str, doc_id: str, result):
+    # Keep the latest finished job in step with a refined result
+    await get_collection(JOBS_COLLECTION).find_one_and_update(
+        {"user_id": user_id, "doc_id": doc_id, "status": "done"},
+        {"$set": {"result": to_plain(result), "refined_at": datetime.utcnow()}},
+        sort=[("finished_at", -1)]
+    )
+
+
+async def _claim_job() -> Optional[dict]:
+    # Atomically take the oldest queued job, or one whose worker lost its lease
+    now = datetime.utcnow()
+    return await get_collection(JOBS_COLLECTION).find_one_and_update(
+        {"$or": [
+            {"status": "queued"},
+            {"status": "running", "lease_expires_at": {"$lt": now}},
+        ]},
+        {
+            "$set": {"status": "running", "started_at": now, "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS)},
+            "$inc": {"attempts": 1},
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _finish(job: dict, update: dict):
+    update["finished_at"] = datetime.utcnow()
+    await get_collection(JOBS_COLLECTION).update_one(
+        {"_id": job["_id"], "status": "running", "attempts": job["attempts"]},
+        {"$set": update, "$unset": {"lease_expires_at": ""}}
+    )
+
+
+async def _keep_lease(job: dict):
+    # Extend the lease while this worker is still on the job, including time spent
+    # waiting for an executor slot, so no other worker claims it and analyses it again
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            await get_collection(JOBS_COLLECTION).update_one(
+                {"_id": job["_id"], "status": "running", "attempts": job["attempts"]},
+                {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)}}
+            )
+        except Exception as e:
+            print(f"Error renewing lease of extraction job {job['_id']}: {e}")
+
+
+def _remove_file(path: Optional[str]):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+async def process_job(job: dict):
+    """Run the extraction for a claimed job and do the same bookkeeping as /extract/."""
+    user_id = job["user_id"]
+    doc_id = job["doc_id"]
+    form_number = job["form_number"]
+    lease = asyncio.create_task(_keep_lease(job))
+    try:
+        if job["attempts"] > JOB_MAX_ATTEMPTS:
+            raise RuntimeError(f"Gave up after {JOB_MAX_ATTEMPTS} attempts")
+        if not os.path.exists(job["file_path"]):
+            raise RuntimeError("Uploaded file is no longer available")
+
+        start_time = datetime.utcnow()
+        output, signature_coordinates = await run(Model.NEURAL_MODELS.get(form_number, ""), Model.extract_with_signature_async, job["file_path"], form_number, job["sha256"])
+        processing_duration = round((datetime.utcnow() - start_time).total_seconds(), 1)
+
+        await _finish(job, {"status": "done", "result": to_plain(output), "processing_duration": processing_duration})
+
+        await publish_task(update_document_processing,
+            user_id=user_id,
+            doc_id=doc_id,
+            status="processed",
+            processing_duration=processing_duration,
+            signature_coordinates=signature_coordinates,
+            field_pages=Model.field_pages(output)
+        )
+        await log_api_call(user_id, doc_id, "/jobs/extract", "success")
+        await log_audit_event(user_id, "document_processed", f"{job['filename']}")
+        await log_audit_event(user_id, "API_call_made", "/jobs/extract")
+        await update_user_statistics(user_id, documents_processed=1, api_calls=1)
+        _remove_file(job["file_path"])
+
+    except asyncio.CancelledError:
+        # Shutting down: the lease runs out and another worker retries the job
+        raise
+    except Exception as e:
+        print(f"Error processing extraction job {job['_id']}: {e}")
+        await _finish(job, {"status": "failed", "error": str(e)})
+        await publish_task(update_document_processing,
+            user_id=user_id,
+            doc_id=doc_id,
+            status="failed",
+            processing_duration=0
+        )
+        await log_api_call(user_id, doc_id, "/jobs/extract", "error")
+        _remove_file(job["file_path"])
+    finally:
+        lease.cancel()
+
+
+async def _run_worker():
+    while True:
+        try:
+            job = await _claim_job()
+        except Exception as e:
+            print(f"Error claiming extraction job: {e}")
+            job = None
+        if job is not None:
+            try:
+                await process_job(job)
+            except Exception as e:
+                # e.g. Mongo unavailable while recording the outcome: the lease runs out and
+                # the job is retried, but this worker must keep running
+                print(f"Error finishing extraction job {job['_id']}: {e}")
+            continue
+        # Nothing queued: sleep until a job is created here or the poll interval passes
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_job_workers():
+    global _wakeup
+    if not _workers:
+        _wakeup = asyncio.Event()
+        _workers.extend(asyncio.create_task(_run_worker()) for _ in range(JOB_WORKERS))
+
+
+async def stop_job_workers():
+    global _wakeup
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _wakeup = None
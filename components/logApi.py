@@ -1,17 +1,15 @@
 from datetime import datetime
 from schemas import APICallSchema
+from collections import Counter
 from typing import Optional
-import os
-from motor.motor_asyncio import AsyncIOMotorClient
+from components.database import get_collection
+from pymongo import InsertOne
+from components.eventBus import publish
+from components.billingRollup import record_api_call
 
 
-MONGODB_URL = os.getenv("MONGODB_URL")
-client = AsyncIOMotorClient(MONGODB_URL)
-database = client["audit_logs_db"]
-api_calls_collection = database.get_collection("api_calls")
 
-
-# Function to log API calls in the database
+# Function to log API calls in the database (written by the event bus in batches)
 async def log_api_call(user_id: str, document_id: Optional[str], api_endpoint: str, status: str):
     api_call = APICallSchema(
         document_id=document_id,
@@ -20,4 +18,23 @@ async def log_api_call(user_id: str, document_id: Optional[str], api_endpoint: s
         timestamp=datetime.utcnow(),
         status=status
     )
-    await api_calls_collection.insert_one(api_call.dict(by_alias=True))
+    await publish(get_collection("api_calls"), InsertOne(api_call.dict(by_alias=True)))
+    await record_api_call(user_id, api_endpoint, status, api_call.timestamp)
+
+
+# Batch variant: one row per call, but a single rollup update per status
+async def log_api_calls(user_id: str, calls: list, api_endpoint: str):
+    """Log [(document_id, status), ...] made to one endpoint."""
+    timestamp = datetime.utcnow()
+    collection = get_collection("api_calls")
+    for document_id, status in calls:
+        api_call = APICallSchema(
+            document_id=document_id,
+            user_id=user_id,
+            api_endpoint=api_endpoint,
+            timestamp=timestamp,
+            status=status
+        )
+        await publish(collection, InsertOne(api_call.dict(by_alias=True)))
+    for status, count in Counter(status for _, status in calls).items():
+        await record_api_call(user_id, api_endpoint, status, timestamp, count)
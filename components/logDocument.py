@@ -1,16 +1,12 @@
 from datetime import datetime
 from schemas import DocumentSchema
 from bson import ObjectId
-import os
 from typing import Optional
-from motor.motor_asyncio import AsyncIOMotorClient
+from components.database import get_collection
+from components.billingRollup import record_document
+from components.signatureCrop import signature_regions
 
 
-MONGODB_URL = os.getenv("MONGODB_URL")
-client = AsyncIOMotorClient(MONGODB_URL)
-database = client["audit_logs_db"]
-documents_collection = database.get_collection("documents")
-
 # Function to log document processing in the database
 async def log_document_processing(user_id: str, document_name: str, size: int, doc_type: str, pages: int, processing_duration: float, status: Optional[str] = None) -> str:
     document = DocumentSchema(
@@ -23,20 +19,87 @@ async def log_document_processing(user_id: str, document_name: str, size: int, d
         number_of_pages=pages,
         processing_duration=processing_duration
     )
-    result = await documents_collection.insert_one(document.dict(by_alias=True))
+    result = await get_collection("documents").insert_one(document.dict(by_alias=True))
+    await record_document(user_id, size, document.processing_timestamp)
     return str(result.inserted_id)  # Return the document_id
 
 
-async def update_document_processing(user_id: str, doc_id: str, status: str, processing_duration: float):
-    doc = await documents_collection.find_one({"_id": ObjectId(doc_id), "user_id": user_id})
-    if not doc:
+# Batch variant of log_document_processing: one insert_many for all documents
+async def log_documents_processing(user_id: str, documents: list) -> list:
+    """Insert [{document_name, size, doc_type, pages}, ...] and return their ids in order."""
+    timestamp = datetime.utcnow()
+    rows = [
+        DocumentSchema(
+            user_id=user_id,
+            document_name=doc["document_name"],
+            processing_timestamp=timestamp,
+            size=doc["size"],
+            type=doc["doc_type"],
+            number_of_pages=doc["pages"],
+            processing_duration=0
+        ).dict(by_alias=True)
+        for doc in documents
+    ]
+    if not rows:
+        return []
+    result = await get_collection("documents").insert_many(rows, ordered=True)
+    for doc in documents:
+        await record_document(user_id, doc["size"], timestamp)
+    return [str(inserted_id) for inserted_id in result.inserted_ids]
+
+
+# A processed document that later fails (or the reverse) becomes partially_processed
+_OPPOSITE_STATUS = {"processed": "failed", "failed": "processed"}
+
+
+async def update_document_processing(user_id: str, doc_id: str, status: str, processing_duration: float, signature_coordinates: Optional[list] = None, field_pages: Optional[list] = None):
+    # Single pipeline update: the duration and status transition are computed by Mongo,
+    # so two endpoints finishing together can't overwrite each other's result
+    opposite = _OPPOSITE_STATUS.get(status)
+    if opposite:
+        new_status = {"$cond": [{"$eq": ["$status", opposite]}, "partially_processed", {"$literal": status}]}
+    else:
+        new_status = {"$literal": status}
+    update = {
+        "status": new_status,
+        "processing_duration": {"$add": [{"$ifNull": ["$processing_duration", 0]}, processing_duration]},
+    }
+    if signature_coordinates:
+        # Kept so /get_signature/ can crop without a second analysis
+        update["signature_coordinates"] = {"$literal": signature_regions(signature_coordinates)}
+    if field_pages:
+        # [[field path, page], ...] so /extract/refine/ knows which pages to re-analyze
+        update["field_pages"] = {"$literal": field_pages}
+    result = await get_collection("documents").update_one(
+        {"_id": ObjectId(doc_id), "user_id": user_id},
+        [{"$set": update}]
+    )
+    if result.matched_count == 0:
         raise ValueError("Document not found")
-    new_processing_duration = doc["processing_duration"] + processing_duration
-    # Check if the current status is 'processed' and the given status is 'error'
-    # or if the current status is 'error' and the given status is 'processed'
-    if (doc["status"] == "processed" and status == "failed") or (doc["status"] == "failed" and status == "processed"):
-        status = "partially_processed"
-    await documents_collection.update_one(
+
+
+async def document_exists(user_id: str, doc_id: str) -> bool:
+    if not ObjectId.is_valid(doc_id):
+        return False
+    return await get_collection("documents").count_documents({"_id": ObjectId(doc_id), "user_id": user_id}, limit=1) > 0
+
+
+async def get_signature_coordinates(user_id: str, doc_id: str) -> Optional[list]:
+    doc = await get_collection("documents").find_one(
         {"_id": ObjectId(doc_id), "user_id": user_id},
-        {"$set": {"status": status, "processing_duration": new_processing_duration}}
-    )
\ No newline at end of file
+        {"signature_coordinates": 1}
+    )
+    if not doc:
+        return None
+    return doc.get("signature_coordinates")
+
+
+async def get_field_pages(user_id: str, doc_id: str) -> Optional[dict]:
+    """{field path: page} stored for a processed document, or None when it was never stored."""
+    doc = await get_collection("documents").find_one(
+        {"_id": ObjectId(doc_id), "user_id": user_id},
+        {"field_pages": 1}
+    )
+    if not doc or not doc.get("field_pages"):
+        return None
+    return dict(doc["field_pages"])
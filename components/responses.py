@@ -0,0 +1,78 @@
+import asyncio
+import contextlib
+import os
+import tempfile
+from typing import Optional
+import orjson
+from fastapi.responses import Response, StreamingResponse
+from components.fieldResult import dumps
+
+
+# Results above this size are sent with chunked transfer encoding
+STREAM_THRESHOLD_BYTES = int(os.getenv("STREAM_THRESHOLD_BYTES", str(1024 * 1024)))
+STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", str(64 * 1024)))
+
+# Opt-in: when set, every extraction result is also written to <dir>/<user_id>/<doc_id>.json
+PERSIST_RESULTS_DIR = os.getenv("PERSIST_RESULTS_DIR")
+
+
+def _iter_chunks(body: bytes):
+    view = memoryview(body)
+    for start in range(0, len(view), STREAM_CHUNK_BYTES):
+        yield bytes(view[start:start + STREAM_CHUNK_BYTES])
+
+
+def json_bytes_response(body: bytes, filename: str = "output.json") -> Response:
+    headers = {"Content-Disposition": f"attachment;filename={filename}"}
+    if len(body) > STREAM_THRESHOLD_BYTES:
+        return StreamingResponse(_iter_chunks(body), media_type="application/json", headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def result_path(user_id: str, doc_id: str) -> Optional[str]:
+    if not PERSIST_RESULTS_DIR:
+        return None
+    return os.path.join(PERSIST_RESULTS_DIR, os.path.basename(str(user_id)), f"{os.path.basename(str(doc_id))}.json")
+
+
+def _write_result(path: str, body: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A temp file per write: /extract/ and /extract/refine/ may write the same doc at once
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
+def _read_result(path: str) -> Optional[dict]:
+    try:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+
+async def load_result(user_id: str, doc_id: str) -> Optional[dict]:
+    """The persisted result of a document, or None when persistence is off or it was never written."""
+    path = result_path(user_id, doc_id)
+    if path is None:
+        return None
+    return await asyncio.to_thread(_read_result, path)
+
+
+async def persist_result(user_id: str, doc_id: Optional[str], body: bytes):
+    path = result_path(user_id, doc_id) if doc_id else None
+    if path is not None:
+        await asyncio.to_thread(_write_result, path, body)
+
+
+async def extraction_response(output: dict, user_id: str, doc_id: Optional[str]) -> Response:
+    """Serialize an extraction result once and send it straight from memory."""
+    body = dumps(output)
+    await persist_result(user_id, doc_id, body)
+    return json_bytes_response(body)
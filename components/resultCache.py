@@ -0,0 +1,156 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Optional
+
+
+# Analysis results are cached by (sha256 of the file, model id, API version)
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join("cache", "results"))
+RESULT_CACHE_DISK_MAX_MB = int(os.getenv("RESULT_CACHE_DISK_MAX_MB", "1024"))
+
+
+class LRUCache:
+    """Size-bounded in-memory LRU with a per-entry TTL."""
+
+    def __init__(self, max_entries: int, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_at, value = entry
+        if self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds:
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.time(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {"entries": len(self._data), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class ResultCache:
+    """Two-tier cache of raw AnalyzeResult dicts: memory LRU in front of a local directory."""
+
+    def __init__(self, directory: str, max_entries: int, ttl_seconds: int, disk_max_bytes: int):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.disk_max_bytes = disk_max_bytes
+        self.memory = LRUCache(max_entries, ttl_seconds)
+        self.disk_hits = 0
+        self.disk_evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: tuple) -> str:
+        file_hash, model_id, api_version = key
+        return os.path.join(self.directory, f"{file_hash}_{model_id}_{api_version}.json")
+
+    def _read_disk(self, key: tuple):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Other workers share the directory and may evict the same file at any point
+        if time.time() - entry["stored_at"] > self.ttl_seconds:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            return None
+        # mtime tracks last use for the disk LRU
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+        return entry["result"]
+
+    def _write_disk(self, key: tuple, result: dict):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"stored_at": time.time(), "result": result}, f, default=_json_default)
+        os.replace(tmp_path, path)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.disk_max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
+            self.disk_evictions += 1
+
+    async def get(self, key: tuple):
+        result = self.memory.get(key)
+        if result is not None:
+            return result
+        result = await asyncio.to_thread(self._read_disk, key)
+        if result is not None:
+            self.disk_hits += 1
+            self.memory.set(key, result)
+        return result
+
+    async def set(self, key: tuple, result: dict):
+        self.memory.set(key, result)
+        await asyncio.to_thread(self._write_disk, key, result)
+
+    def stats(self) -> dict:
+        memory = self.memory.stats()
+        return {
+            "hits": memory["hits"] + self.disk_hits,
+            "misses": memory["misses"] - self.disk_hits,
+            "memory": memory,
+            "disk": {"hits": self.disk_hits, "evictions": self.disk_evictions},
+        }
+
+
+result_cache = ResultCache(
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_TTL_SECONDS,
+    RESULT_CACHE_DISK_MAX_MB * 1024 * 1024,
+)
@@ -0,0 +1,90 @@
+import io
+import os
+import pypdfium2 as pdfium
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import RectangleObject
+from components.resultCache import LRUCache
+from components.geometry import bbox, to_pdf_space, edge_margins
+
+
+# Signature regions are stored as [{"page": 1-based page number, "points": [[x, y], ...]}]
+# in points (1/72 inch) measured from the top-left corner of the page, as Azure reports them.
+# Documents processed before regions carried a page number hold a flat list of points,
+# four per signature, all on the first page.
+POINTS_PER_REGION = 4
+
+# Image output for /get_signature/: resolution and the rendered images kept in memory
+IMAGE_FORMATS = {"png": ("PNG", "image/png"), "webp": ("WEBP", "image/webp")}
+SIGNATURE_IMAGE_DPI = int(os.getenv("SIGNATURE_IMAGE_DPI", "150"))
+SIGNATURE_IMAGE_CACHE_ENTRIES = int(os.getenv("SIGNATURE_IMAGE_CACHE_ENTRIES", "1024"))
+
+signature_image_cache = LRUCache(SIGNATURE_IMAGE_CACHE_ENTRIES)
+
+
+def signature_regions(coordinates) -> list:
+    """Normalise stored or freshly extracted signature coordinates to a list of regions."""
+    if not coordinates:
+        return []
+    if isinstance(coordinates[0], dict):
+        return [{"page": int(region.get("page", 1)), "points": region["points"]} for region in coordinates if region.get("points")]
+    return [
+        {"page": 1, "points": coordinates[start:start + POINTS_PER_REGION]}
+        for start in range(0, len(coordinates), POINTS_PER_REGION)
+    ]
+
+
+def region_box(page, points) -> RectangleObject:
+    """Bounding box of a region in the page's own coordinate space (origin bottom-left)."""
+    box = to_pdf_space(bbox(points), float(page.mediabox.left), float(page.mediabox.top))
+    return RectangleObject(box.tolist())
+
+
+def crop_signatures(pdf_bytes: bytes, coordinates) -> bytes:
+    """Return a PDF with one page per signature region, cropped out of the uploaded PDF bytes.
+
+    Pages are only re-framed (mediabox/cropbox), their content is not re-rendered,
+    and nothing touches the disk.
+    """
+    regions = signature_regions(coordinates)
+    if not regions:
+        raise ValueError("No signature regions found")
+
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    writer = PdfWriter()
+    for region in regions:
+        if not 1 <= region["page"] <= len(reader.pages):
+            raise ValueError(f"Signature on page {region['page']} but the PDF has {len(reader.pages)} pages")
+        source = reader.pages[region["page"] - 1]
+        box = region_box(source, region["points"])
+        # add_page copies the page object, so several crops of one page don't interfere
+        page = writer.add_page(source)
+        page.mediabox = box
+        page.cropbox = box
+
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def image_cache_key(file_hash: str, region: dict, image_format: str) -> tuple:
+    polygon = tuple((round(float(x), 2), round(float(y), 2)) for x, y in region["points"])
+    return (file_hash, region["page"], polygon, image_format, SIGNATURE_IMAGE_DPI)
+
+
+def render_signature(pdf_bytes: bytes, region: dict, image_format: str = "png") -> bytes:
+    """Rasterise one signature region to a PNG/WebP image (blocking; run it off the loop)."""
+    pil_format, _ = IMAGE_FORMATS[image_format]
+    document = pdfium.PdfDocument(pdf_bytes)
+    try:
+        if not 1 <= region["page"] <= len(document):
+            raise ValueError(f"Signature on page {region['page']} but the PDF has {len(document)} pages")
+        page = document[region["page"] - 1]
+        width, height = page.get_size()
+        # pdfium crops by the margin to cut from each edge (left, bottom, right, top)
+        crop = tuple(edge_margins(bbox(region["points"]), width, height).tolist())
+        image = page.render(scale=SIGNATURE_IMAGE_DPI / 72, crop=crop).to_pil()
+        out = io.BytesIO()
+        image.save(out, format=pil_format)
+        return out.getvalue()
+    finally:
+        document.close()
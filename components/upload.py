@@ -1,22 +1,17 @@
-import os
-import shutil
-import json
-import PyPDF2
 import model as Model
 from datetime import datetime
 from fastapi import FastAPI, APIRouter, File, UploadFile, Request, HTTPException
-from fastapi.responses import StreamingResponse
 from components.getToken import get_current_user_from_cookie
 from components.logDocument import log_document_processing
 from components.logApi import log_api_call
 from components.userStatistics import update_user_statistics
 from components.logAudit import log_audit_event
+from components.executor import run
+from components.ingest import ingest_upload, discard
+from components.responses import extraction_response
 
 app = FastAPI()
 
-upload_dir = "uploads"
-os.makedirs(upload_dir, exist_ok=True)
-
 
 # Endpoint to upload a file and process it
 @app.post("/upload/")
@@ -28,26 +23,17 @@ async def upload_file(request: Request, file: UploadFile = File(...), form_numbe
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized: No valid user token found")
 
+    ingested = None
     try:
-        file_path = os.path.join(upload_dir, file.filename)
         print(f"User details: {user}")
 
-        # Save the file
-        with open(file_path, "wb") as image:
-            shutil.copyfileobj(file.file, image)
-
-        # Get the file size in bytes
-        file.file.seek(0, os.SEEK_END)
-        file_size = file.file.tell()
-        file.file.seek(0, os.SEEK_SET)
-        reader = PyPDF2.PdfReader(file.file)
-        num_pages = len(reader.pages)
-        
-        file_path1 = file_path
+        # Stream the upload to a unique file, hashing it on the way
+        ingested = await ingest_upload(file)
+        file_size = ingested.size
 
         # Call the model to process the file
         start_time = datetime.utcnow()
-        output = Model.myModel(file_path1, form_number)
+        output, _ = await run(Model.NEURAL_MODELS.get(form_number, ""), Model.extract_with_signature_async, ingested.path, form_number, ingested.sha256)
         end_time = datetime.utcnow()
 
         # Calculate processing duration
@@ -60,7 +46,7 @@ async def upload_file(request: Request, file: UploadFile = File(...), form_numbe
             status="processed", 
             size=file_size, 
             doc_type=file.content_type,
-            pages=5,  # Example number of pages
+            pages=ingested.pages,
             processing_duration=processing_duration  # Pass the duration here
         )
 
@@ -74,28 +60,20 @@ async def upload_file(request: Request, file: UploadFile = File(...), form_numbe
         # Update user statistics
         await update_user_statistics(user["id"], documents_processed=1, api_calls=1)
 
-        # Write output to JSON file
-        with open('output.json', 'w') as f:
-            json.dump(output, f)
-
-        # Stream JSON file as response
-        def iterfile():
-            with open('output.json', 'rb') as f:
-                yield from f
-
-        # Send JSON file as response
-        response = StreamingResponse(iterfile(), media_type='application/json',
-                                     headers={'Content-Disposition': 'attachment;filename=output.json'})
-
-        # Cleanup file
-        os.remove(file_path1)
+        # Serialize once and answer from memory
+        response = await extraction_response(output, user["id"], document_id)
 
         return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error during file upload: {e}")
         await log_api_call(user["id"], None, "/upload/", "error")
         await log_audit_event(user["id"], "document_processing_failed", f"Failed to process document {file.filename}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    finally:
+        # Cleanup file
+        discard(ingested)
     
     
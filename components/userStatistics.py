@@ -2,41 +2,87 @@ from datetime import datetime
 from schemas import UserStatisticSchema
 from typing import Optional
 import calendar
-import os
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from components.database import get_collection
+from components.eventBus import publish_task
 
 
-MONGODB_URL = os.getenv("MONGODB_URL")
-client = AsyncIOMotorClient(MONGODB_URL)
-database = client["audit_logs_db"]
-user_statistics_collection = database.get_collection("user_statistics")
+# Increments waiting to be written, merged per (user_id, month) so hot users cost one write per flush
+_pending = {}
+_flush_scheduled = False
 
-# Function to update user statistics for billing
+
+# Function to update user statistics for billing, applied in the background by the event bus
 async def update_user_statistics(user_id: str, documents_processed: int, api_calls: int):
-    current_month = datetime.utcnow().strftime("%Y-%m")
-    
-    # Check if there is an entry for the current month
-    user_stats = await user_statistics_collection.find_one({"user_id": user_id, "month": current_month})
-    
-    if user_stats:
-        # Update existing user statistics by incrementing values
-        await user_statistics_collection.update_one(
-            {"user_id": user_id, "month": current_month},
-            {"$inc": {"total_documents_processed": documents_processed, "total_api_calls": api_calls}}
-        )
+    global _flush_scheduled
+    now = datetime.utcnow()
+    key = (user_id, now.strftime("%Y-%m"))
+
+    counts = _pending.get(key)
+    if counts is None:
+        _pending[key] = {"documents_processed": documents_processed, "api_calls": api_calls, "first_seen": now}
     else:
-        # Calculate the last day of the current month
-        now = datetime.utcnow()
-        last_day_of_month = calendar.monthrange(now.year, now.month)[1]
-        billing_period_end = datetime(now.year, now.month, last_day_of_month, 23, 59, 59)
-        
-        # Insert new user statistics for the new month
-        user_stat = UserStatisticSchema(
-            user_id=user_id,
-            month=current_month,
-            billing_period_start=now,
-            billing_period_end=billing_period_end,
-            total_documents_processed=documents_processed,
-            total_api_calls=api_calls
-        )
-        await user_statistics_collection.insert_one(user_stat.dict(by_alias=True))
\ No newline at end of file
+        counts["documents_processed"] += documents_processed
+        counts["api_calls"] += api_calls
+
+    if not _flush_scheduled:
+        _flush_scheduled = True
+        await publish_task(flush_user_statistics)
+
+
+def _upsert_operation(user_id: str, month: str, counts: dict) -> UpdateOne:
+    # Calculate the last day of the current month
+    now = counts["first_seen"]
+    last_day_of_month = calendar.monthrange(now.year, now.month)[1]
+    billing_period_end = datetime(now.year, now.month, last_day_of_month, 23, 59, 59)
+
+    # Fields only written when this is the first event of the month
+    user_stat = UserStatisticSchema(
+        user_id=user_id,
+        month=month,
+        billing_period_start=now,
+        billing_period_end=billing_period_end,
+        total_documents_processed=0,
+        total_api_calls=0
+    ).dict(by_alias=True, exclude={"user_id", "month", "total_documents_processed", "total_api_calls"})
+
+    return UpdateOne(
+        {"user_id": user_id, "month": month},
+        {
+            "$inc": {"total_documents_processed": counts["documents_processed"], "total_api_calls": counts["api_calls"]},
+            "$setOnInsert": user_stat,
+        },
+        upsert=True
+    )
+
+
+async def flush_user_statistics():
+    global _pending, _flush_scheduled
+    pending, _pending = _pending, {}
+    _flush_scheduled = False
+    if not pending:
+        return
+    operations = [_upsert_operation(user_id, month, counts) for (user_id, month), counts in pending.items()]
+    try:
+        await get_collection("user_statistics").bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Unordered: only the operations listed as errors were not applied
+        failed = {error["index"] for error in e.details["writeErrors"]}
+        _restore({key: counts for index, (key, counts) in enumerate(pending.items()) if index in failed})
+        raise
+    except Exception:
+        # Put the increments back so the event bus retry (or the next flush) writes them
+        _restore(pending)
+        raise
+
+
+def _restore(pending: dict):
+    for key, counts in pending.items():
+        current = _pending.get(key)
+        if current is None:
+            _pending[key] = counts
+        else:
+            current["documents_processed"] += counts["documents_processed"]
+            current["api_calls"] += counts["api_calls"]
+            current["first_seen"] = min(current["first_seen"], counts["first_seen"])
@@ -1,14 +1,19 @@
-from azure.core.credentials import AzureKeyCredential
-from azure.ai.formrecognizer import DocumentAnalysisClient
-import json
+from azure.ai.formrecognizer import AnalyzeResult
+from components.azureClients import get_client_for_form, close_clients, AZURE_API_VERSION
+from components.resultCache import result_cache, hash_bytes
+from components.executor import run, holds_slot
+from components.formSchemas import FORM_SCHEMAS, get_form_schema, set_field, iter_fields
+from components.signatureCrop import crop_signatures
+from components.geometry import FieldGeometry
+from components.fieldResult import FieldResult, dumps_pretty
+import asyncio
+import io
 from PyPDF2 import PdfWriter, PdfReader, PdfMerger
 from PyPDF2.generic import FloatObject
 from fastapi import FastAPI, File, UploadFile
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import date, datetime
 import shutil
-from tempfile import NamedTemporaryFile
 import os
 import logging
 from dotenv import load_dotenv
@@ -17,709 +22,357 @@ load_dotenv()
 
 logger = logging.getLogger()
 
+# Azure model ids used for each form number
+NEURAL_MODELS = {number: schema.neural_model_id for number, schema in FORM_SCHEMAS.items()}
+TEMPLATE_MODELS = {number: schema.template_model_id for number, schema in FORM_SCHEMAS.items()}
 
-def convert_dates_in_dict(data):
-    """Recursively converts all date and datetime objects in a dictionary to ISO formatted strings."""
-    if isinstance(data, dict):
-        return {k: convert_dates_in_dict(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [convert_dates_in_dict(i) for i in data]
-    elif isinstance(data, (date, datetime)):
-        return data.isoformat()
-    return data
-
-
-def myModel(file_path,form_number): 
-    endpoint = os.getenv("ENDPOINT")
-    key = os.getenv("KEY")
-    model_id = ""
-
-    if form_number == 1:
-        model_id="Form1_Neural"
-    elif form_number == 2:
-        model_id="Form2_Neural"
-    elif form_number == 3:
-        model_id="Form3_Neural"
-    elif form_number == 4:
-        key = os.getenv("KEY2")
-        endpoint = os.getenv("ENDPOINT2")
-        model_id="voter_neural"
-    FORM_NAME = file_path
-
-    document_intelligence_client = DocumentAnalysisClient(
-    endpoint=endpoint, credential=AzureKeyCredential(key)
-    )
-
-    with open(FORM_NAME, "rb") as f:
-        poller = document_intelligence_client.begin_analyze_document(
-            model_id, document=f
+# Split PDFs longer than this many pages into chunks analysed concurrently (0 = never split).
+# Each chunk is analysed as a document of its own, so a field name can be read in several
+# chunks (e.g. the voter form's blocks "1".."10" restart in every chunk). Only the most
+# confident reading fills the field; when the readings differ all of them are listed,
+# with their pages, under CHUNK_CONFLICTS in the output.
+PAGES_PER_CHUNK = int(os.getenv("PAGES_PER_CHUNK", "0"))
+CHUNK_CONFLICTS = "chunk_conflicts"
+# Chunk analyses in flight for one document
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "4"))
+
+
+def _run_sync(coro):
+    # Scripts get a fresh event loop, so the shared clients are closed with it
+    async def runner():
+        try:
+            return await coro
+        finally:
+            await close_clients()
+    return asyncio.run(runner())
+
+
+async def analyze_cached(form_number, model_id, file_path, file_hash=None, document=None):
+    """Analyze a file, reusing a cached result for identical files.
+
+    Pass file_hash when the upload was already hashed to skip reading the file on a hit,
+    or document to analyze bytes already in memory (file_path is then ignored).
+    """
+    if document is not None:
+        file_hash = file_hash or hash_bytes(document)
+    elif file_hash is None:
+        with open(file_path, "rb") as f:
+            document = f.read()
+        file_hash = hash_bytes(document)
+
+    key = (file_hash, model_id, AZURE_API_VERSION)
+    cached = await result_cache.get(key)
+    if cached is not None:
+        return AnalyzeResult.from_dict(cached)
+
+    document_intelligence_client = get_client_for_form(form_number)
+    if document is not None:
+        poller = await document_intelligence_client.begin_analyze_document(
+            model_id, document=document
         )
-    result = poller.result()
-
-
-    coordinates=[]
-
-    if form_number == 1:
-     storage={"Root": {
-            "Branch_Name": [],
-            "Date": [],
-            "Cif_No": [],
-            "Name": [],
-            "Company_Name": [],
-            "Enrollment_Instructions": {
-                "Account_Number": [],
-                "Atm_Card": {
-                    "Avail": [],
-                    "No_Need": [],
-                    "ATM_Card_Number": []
-                },
-                "Mobile_Banking": {
-                    "Enroll": [],
-                    "No_Need": []
-                },
-                "Online_Banking": {
-                    "Enroll": [],
-                    "No_Need": [],
-                    "User_Id": []
-                },
-                "Preferred_User_Ids": {
-                    "Id1": [],
-                    "Id2": [],
-                    "Id3": []
-                }
-            },
-            "Maintenance_Requests": {
-                "Atm_Card": {
-                    "Atm_Card_Number": [],
-                    "Request_For_Atm_Card_Replacement":[],
-                    "Request_For_Atm_Card_Replacement_With_New_Card_Name": {
-                        "Box": [],
-                        "Atm_Card_Name": []
-                    },
-                    "Request_For_Atm_Pin": [],
-                    "Unlink_Drop_Account_Numbers": {
-                        "Unlink": [],
-                        "Account_Numbers": []
-                    },
-                    "Close_Atm_Account": {
-                        "Box":[],
-                        "Reason": []
-                    }
-                
-                },
-                "Mobile_Banking": {
-                    "User_Id": [],
-                    "Suspend_Access": [],
-                    "Reason": []
-                },
-                "Online_Banking": {
-                    "Username":[],
-                    "Request_For_Online_Banking_Login": [],
-                    "Request_For_Online_Banking_Transaction_Password": [],
-                    "Increase_My_Fund_Transfer": [],
-                    "Unlink_Drop_Account_Numbers": {
-                        "Unlink": [],
-                        "Account_Numbers": []
-                    },
-                    "Close_Online_Banking_Account": {
-                        "Box":[],
-                        "Reason": []
-                    }
-                },
-                "Phone_Banking": {
-                    "Phone_Banking_Account_Number": [],
-                    "Request_For_Phone_Banking_Access_Tpin": [],
-                    "Request_For_Phone_Banking_Transaction_Tpin": [],
-                    "Unlink_Drop_Account_Numbers": {
-                        "Unlink": [],
-                        "Account_Numbers": []
-                    },
-                    "Link_Drop_Account_Number": {
-                        "Link": [],
-                        "Drop":[],
-                        "Account_Numbers": []
-                    },
-                    "For_Interbank_Fund_Transfers": {
-                        "Account_Name": [],
-                        "Name_Of_Bank": []
-                    }
-                },
-                "Remarks": []
-            },
-            "Receiving_Branch": {
-                "Received_By_Date": [],
-                "Branch_Name": []
-            },
-            "Maintaining_Branch": {
-                "Checked_By_Date": [],
-                "Approved_By_Date": []
-            },
-            "Alternative_Channels_Division": {
-                "Received_By_Date": [],
-                "Processed_By_Date": [],
-                "Checked_By_Date": []
-            },
-            "Customer's_Acknowledgment": {
-                "Atm_Card": {
-                    "Issued_By_Date": [],
-                    "Received_By_Date": []
-                },
-                "Atm_Pin": {
-                    "Issued_By_Date": [],
-                    "Received_By_Date": []
-                },
-                "Phone_Banking_Tpin": {
-                    "Issued_By_Date": [],
-                    "Received_By_Date": []
-                }
-            }
-        }
-    }
-    elif form_number == 2:
-      storage={"Root": {
-        "Phillippine_Peso": [],
-        "Us_Dollar": [],
-        "Branch": [],
-        "Date_Accomplished": [],
-        "Name": [],
-        "Gender": {
-        "Male": [],
-        "Female": []
-        },
-        "Date_Of_Birth": [],
-        "Place_Of_Birth": {
-        "Philippines": [],
-        "Others": {
-            "Box": [],
-            "Value": []
-        }
-        },
-        "Nationality": {
-        "Filipino": [],
-        "Others": {
-            "Box": [],
-            "Value": []
-        }
-        },
-        "Civil_Status": {
-        "Single": [],
-        "Married": [],
-        "Separated": [],
-        "Divorced": [],
-        "Widowed": []
-        },
-        "Name_Of_Spouse": [],
-        "Mother_Maiden_Name": [],
-        "Mobile_Phone_Number": [],
-        "Email_Address": [],
-        "Home_Permanent_Address": [],
-        "Present_Address": {
-        "Same_As_Home_Address": [],
-        "Others": []
-        },
-        "Home_Phone_Number": [],
-        "Tin_Sss_Gsis": {
-            "Tin":[],
-            "Sss":[],
-            "Gsis":[],
-            "Value": []
-        },
-        "Source_Of_Fund": {
-        "Business": [],
-        "Funds_From_Family_Member": [],
-        "Inheritance": [],
-        "Pension": [],
-        "Rent": [],
-        "Savings": [],
-        "Commission": [],
-        "Gifts_And_Donations": [],
-        "Interest": [],
-        "Profession": [],
-        "Salary": [],
-        "Winnings": [],
-        "Dividend": [],
-        "Government_Assistance": [],
-        "Investments": [],
-        "Remittance": [],
-        "Sale_Of_Property": []
-        },
-        "Employment_Type": {
-        "Employed": [],
-        "Self_Employed_Business": [],
-        "Self_Employed_Professional": [],
-        "Retired": [],
-        "Not_Applicable": [],
-        "Others": {
-            "Box": [],
-            "Value": []
-        }
-        },
-        "Estimated_Monthly_Transaction": {
-        "Below_PHP_20000": [],
-        "PHP_20000_To_49999": [],
-        "PHP_50000_To_99999": [],
-        "PHP_100000_To_499999": [],
-        "PHP_500000_To_999000": [],
-        "PHP_1000000_And_Above": []
-        },
-        "Nature_Of_Business": {
-            "Admin_Support": [],
-            "Financial": [],
-            "Professional_Service": [],
-            "Agriculture": [],
-            "IT": [],
-            "Transportation": [],
-            "Construction": [],
-            "Manufacturing": [],
-            "Wholesale": [],
-            "Education": [],
-            "Mining": [],
-            "Others": {
-            "Box": [],
-            "Value": []
-            }
-        },
-        "Occupation": {
-            "Accountant": [],
-            "Lawyer": [],
-            "Custom_Broker": [],
-            "Money_Changer": [],
-            "Expatriate": [],
-            "Student": [],
-            "Jeweler": [],
-            "Others": {
-            "Box": [],
-            "Value": []
-            }
-        },
-        "Business_Name": [],
-        "Work_Business_Phone_Number":[],
-        "Work_Business_Address": [],
-        "Preferred_Mailing_Address": {
-        "Home_Permanent_Address": [],
-        "Present_Address": []
-        },
-        "Residency": {
-        "Resident": [],
-        "ACR_I_Card_No": [],
-        "Non_Resident": []
-        },
-        "Affiliations_With_China_Bank": {
-        "I_Am_A_Director": {
-            "Yes": [],
-            "No": [],
-            "Employee_No": []
-        },
-        "My_Relative_Is_A_Director": {
-            "Yes": [],
-            "No": [],
-            "Name": []
-        },
-        "I_Am_Related": {
-            "Yes": [],
-            "No": []
-        },
-        "Relationship_With_Government_Personnel": {
-            "Occupying":[],
-            "Relative": [],
-            "Association": [],
-            "Position": []
-            }
-        },
-        "For_Bank_Use": {
-        "Branch_Unit": [],
-        "Cif_No": [],
-        "Oks_Account_No": [],
-        "Atm_Card_No": [],
-        "Referred_By": [],
-        "Industry_Sub_Class": [],
-        "Interviewed_By_Date": [],
-        "Sig_Verified_By_Date": [],
-        "Approved_By_Date": [],
-        "Account_Opened_By_Date": [],
-        "Scanned_By_Date": []
-        },
-        "Account_Opening_Kit": {
-        "Atm_Card": [],
-        "Atm_Pin": []
-        },
-        "Foreign_Account_Tax_Information": {
-        "Are_You_Us_Citizen": {
-            "Yes": [],
-            "No": []
-        },
-        "Do_You_Have_Any_Records_In_Us": {
-            "Yes": [],
-            "No": []
-        }
-        },
-        "Access_To_Alternative_Channels": {
-        "Mobile_Banking": {
-            "Enroll": [],
-            "No_Need": []
-        },
-        "Online_Banking": {
-            "Enroll": [],
-            "No_Need": [],
-            "Preferred_User_Id": {
-            "1": [],
-            "2": [],
-            "3": []
-            }
-        }
-        }
-     }
-    }
-    elif form_number == 3:
-      storage={"Root": {
-        "Atm_Savings": [],
-        "Atm_Checking": [],
-        "Branch": [],
-        "Date_Accomplished": [],
-        "Company_Name": [],
-        "Access_To_Alternative_Channels": {
-        "Mobile_Banking": {
-            "Enroll": [],
-            "No_Need": []
-        },
-        "Online_Banking": {
-            "Enroll": [],
-            "No_Need": [],
-            "Preferred_User_Id": {
-            "Preferred_User_Id1": [],
-            "Preferred_User_Id2": [],
-            "Preferred_User_Id3": []
-            }
-        }
-        },
-        "For_Bank_Use": {
-        "Employee_Cif_No": [],
-        "Employer_Cif_No": [],
-        "Employee_Account_No": [],
-        "Atm_Card_No": [],
-        "Referred_By": [],
-        "Sig_Verified_By_Date": [],
-        "Account_Opened_By_Date": [],
-        "Approved_By_Date": [],
-        "Scanned_By_Date": []
-        },
-        "For_Acd_Use": {
-        "Received_By_Date": [],
-        "Processed_By_Date": [],
-        "Checked_By_Date": [],
-        "Remarks": []
-        },
-        "Employee_Information": {
-        "Name": [],
-        "Gender": {
-            "Male": [],
-            "Female": []
-        },
-        "Date_Of_Birth": [],
-        "Place_Of_Birth": {
-            "Philippines": [],
-            "Others": {
-            "Box": [],
-            "Value": []
-            }
-        },
-        "Nationality": {
-            "Filipino": [],  
-            "Others": {
-            "Box": [],   
-            "Value": []    
-            }
-        },
-        "Civil_Status": {
-            "Single": [],
-            "Married": [],
-            "Separated": [],
-            "Divorced": [],
-            "Widowed": []
-        },
-        "Name_Of_Spouse": [],
-        "Mother_Maiden_Name": [],
-        "Home_Phone_Number": [],
-        "Home_Permanent_Address": [],
-        "Home_Permanent_Address_Zip_Code": [],
-        "Present_Address": {
-            "Same_As_Home_Address": [],
-            "Others": [],
-            "Zipcode":[]
-            },
-        "Mobile_Phone_Number": [],
-        "Email_Address": [],
-        "Tin_Sss": {
-            "Tin":[],
-            "Sss":[],
-            "Value": []
-        },
-        "Occupation": {
-            "Accountant": [],
-            "Custom_Broker": [],
-            "Jeweler": [],
-            "Lawyer": [],
-            "Money_Changer": [],
-            "Others": {
-            "Box": [],
-            "Value": []
-            }
-        },
-        "Employee_Id": [],
-        "Date_Hired": [],
-        "Gross_Monthly_Income": {
-            "Below_PHP_20000": [],
-            "PHP_20000_To_49999": [],
-            "PHP_50000_To_99999": [],
-            "PHP_100000_To_499999": [],
-            "PHP_500000_To_999000": [],
-            "PHP_1000000_And_Above": []
-        },
-        "Employer_Nature_Of_Business": {
-            "Agriculture_Fishing": [],
-            "Admin_Support": [],
-            "Construction": [],
-            "Education": [],
-            "Financial_Insurance": [],
-            "It_Communication": [],
-            "Manufacturing": [],
-            "Mining_Quarrying": [],
-            "Professional_Service": [],
-            "Transportation_Storage": [],
-            "Wholesale_Retail": [],
-            "Others": {
-            "Box": [],
-            "Value": []
-            }
-        },
-        "Work_Business_Address": [],
-        "Work_Business_Phone_Number":[],
-        "Affiliations_With_China_Bank": {
-            "I_Am_A_Director": {
-                "Yes": [],
-                "No": [],
-                "Employee_No": []
-            },
-            "My_Relative_Is_A_Director": {
-                "Yes": [],
-                "No": [],
-                "Name": [],
-                "Relationship": []
-            },
-            "I_Am_Related": {
-                "Yes": [],
-                "No": []
-            },
-            "Relationship_With_Government_Personnel": {
-                "Occupying":[],
-                "Relative": [],
-                "Association": [],
-                "Position": []
-                }
-            },
-        "Residency": {
-            "Resident": [],
-            "Acr_I_Card_No": [],
-            "Non_Resident": []
-        },
-        "Preferred_Mailing_Address": {
-            "Home_Permanent_Address": [],
-            "Present_Address": [],
-            "Work_Business_Address": []
-        }
-        },
-        "Foreign_Account_Tax_Compliance_Act_Information": {
-        "Are_You_Us_Citizen": {
-            "Yes": [],
-            "No": []
-        },
-        "Do_You_Have_Any_Records_In_Us": {
-            "Yes": [],
-            "No": []
-        }
-        }
-    
-    }
-   } 
-    elif form_number == 4:
-      storage={"Root": {
-        "1": {
-            "Name": [],
-            "Street": [],
-            "City": [],
-            "Phonenumber": [],
-            "Email": [],
-            "Date": []
-        },
-        "2": {
-            "Name": [],
-            "Street": [],
-            "City": [],
-            "Phonenumber": [],
-            "Email": [],
-            "Date": []
-        },
-        "3": {
-            "Name": [],
-            "Street": [],
-            "City": [],
-            "Phonenumber": [],
-            "Email": [],
-            "Date": []
-        },
-        "4": {
-            "Name": [],
-            "Street": [],
-            "City": [],
-            "Phonenumber": [],
-            "Email": [],
-            "Date": []
-        },
-        "5": {
-            "Name": [],
-            "Street": [],
-            "City": [],
-            "Phonenumber": [],
-            "Email": [],
-            "Date": []
-        },
-        "6": {
-            "Name": [],
-            "Street": [],
-            "City": [],
-            "Phonenumber": [],
-            "Email": [],
-            "Date": []
-        },
-        "7": {
-            "Name": [],
-            "Street": [],
-            "City": [],
-            "Phonenumber": [],
-            "Email": [],
-            "Date": []
-        },
-        "8": {
-            "Name": [],
-            "Street": [],
-            "City": [],
-            "Phonenumber": [],
-            "Email": [],
-            "Date": []
-        },
-        "9": {
-            "Name": [],
-            "Street": [],
-            "City": [],
-            "Phonenumber": [],
-            "Email": [],
-            "Date": []
-        },
-        "10": {
-            "Name": [],
-            "Street": [],
-            "City": [],
-            "Phonenumber": [],
-            "Email": [],
-            "Date": []
-        }
-     }
-    }
-        
-    for document in result.documents:
-        for name, field in document.fields.items():
-            value=field.value if field.value else field.content
-            #print(f"{name}={value} [{field.confidence}]")
-            storage[name]=[value,field.confidence]
-            if "signature" in name.lower():
-                points=field.bounding_regions[0].polygon
-                for p in points:
-                    coordinates.append((p.x*72,p.y*72))
-
-    # After populating the `storage` dictionary, convert date fields
-    storage = convert_dates_in_dict(storage)  # Apply conversion to all date fields in the dictionary
-
-    # Now convert `storage` to JSON
-    nested_dict = {}
-    for key, value in storage.items():
-        keys_list = key.split("|")
-        temp_dict = nested_dict
-
-        for k in keys_list[:-1]:
-            temp_dict = temp_dict.setdefault(k, {})
-
-        temp_dict[keys_list[-1]] = value
-
-    json_str = json.dumps(nested_dict, indent=4)
-    return json_str
+    else:
+        with open(file_path, "rb") as f:
+            poller = await document_intelligence_client.begin_analyze_document(
+                model_id, document=f
+            )
+    result = await poller.result()
+    await result_cache.set(key, result.to_dict())
+    return result
 
 
+def myModel(file_path,form_number):
+    """Sync shim around myModel_async for scripts."""
+    return _run_sync(myModel_async(file_path, form_number))
 
-def analyze_document(file_path,form_number):
-   
-    endpoint = os.getenv("ENDPOINT")
-    key = os.getenv("KEY")
-    model_id = ""
-
-    if form_number == 1:
-        model_id="Form1_Template"
-    elif form_number == 2:
-        model_id="Form2_Template"
-    elif form_number == 3:
-        model_id="Form3_Templatee"
-    elif form_number == 4:
-        endpoint = os.getenv("ENDPOINT2")
-        key = os.getenv("KEY2")
-        model_id="voter_neural"
-
-    document_intelligence_client = DocumentAnalysisClient(
-        endpoint=endpoint, credential=AzureKeyCredential(key)
-    )
-  
+
+async def myModel_async(file_path, form_number):
+    output, _ = await extract_with_signature_async(file_path, form_number)
+    return dumps_pretty(output)
+
+
+async def extract_with_signature_async(file_path, form_number, file_hash=None, pages_per_chunk=None):
+    """Run the neural model once and return (output dict, signature coordinates).
+
+    PDFs longer than pages_per_chunk (default PAGES_PER_CHUNK) are split and the
+    chunks analysed concurrently, see analyze_in_chunks.
+    """
+    model_id = NEURAL_MODELS.get(form_number, "")
+    pages_per_chunk = PAGES_PER_CHUNK if pages_per_chunk is None else pages_per_chunk
+
+    if pages_per_chunk > 0:
+        chunks = await asyncio.to_thread(split_pdf, file_path, pages_per_chunk)
+        if len(chunks) > 1:
+            if file_hash is None:
+                file_hash = await asyncio.to_thread(_hash_file, file_path)
+            results = await analyze_in_chunks(form_number, model_id, file_hash, chunks, pages_per_chunk)
+            return build_output(results, form_number)
+
+    result = await analyze_cached(form_number, model_id, file_path, file_hash)
+
+    return build_output(result, form_number)
+
+
+def _hash_file(file_path):
     with open(file_path, "rb") as f:
-        poller = document_intelligence_client.begin_analyze_document(
-            model_id, document=f
-        )
-    result = poller.result()
+        return hash_bytes(f.read())
+
+
+def split_pdf(file_path, pages_per_chunk):
+    """Split a PDF into [(first page index, chunk bytes)]; a single entry means no split was needed."""
+    with open(file_path, "rb") as f:
+        if f.read(5) != b"%PDF-":
+            return [(0, None)]
+        f.seek(0)
+        reader = PdfReader(f)
+        total = len(reader.pages)
+        if total <= pages_per_chunk:
+            return [(0, None)]
+
+        chunks = []
+        for first in range(0, total, pages_per_chunk):
+            writer = PdfWriter()
+            for page in reader.pages[first:first + pages_per_chunk]:
+                writer.add_page(page)
+            out = io.BytesIO()
+            writer.write(out)
+            chunks.append((first, out.getvalue()))
+    return chunks
+
+
+async def analyze_in_chunks(form_number, model_id, file_hash, chunks, pages_per_chunk):
+    """Analyze PDF chunks concurrently; returns the results with page numbers shifted back to the full document.
+
+    Every chunk runs under the executor's per-model cap. A caller already inside
+    run() for this model keeps analysing through its own slot and only the extra
+    workers queue for more, so documents waiting on each other can't deadlock.
+    """
+    async def analyze_chunk(first, data):
+        # Cached per (document, page range) so a retry only re-runs the chunks that failed
+        chunk_hash = hash_bytes(f"{file_hash}:{first}:{pages_per_chunk}".encode())
+        result = await analyze_cached(form_number, model_id, None, chunk_hash, document=data)
+        for document in result.documents:
+            for field in document.fields.values():
+                for region in field.bounding_regions or []:
+                    region.page_number += first
+        return result
+
+    pending = iter(chunks)
+    results = {}
+    done = asyncio.Event()
+
+    async def take_and_analyze():
+        # Only pulls a chunk once a slot is held, so no chunk waits behind another document
+        item = next(pending, None)
+        if item is None:
+            return False
+        first, data = item
+        results[first] = await analyze_chunk(first, data)
+        if len(results) == len(chunks):
+            done.set()
+        return True
+
+    async def own_worker():
+        while await take_and_analyze():
+            pass
+
+    async def extra_worker():
+        while await run(model_id, take_and_analyze):
+            pass
+
+    held = holds_slot(model_id)
+    workers = [
+        asyncio.create_task(own_worker() if held and index == 0 else extra_worker())
+        for index in range(min(CHUNK_CONCURRENCY, len(chunks)))
+    ]
+    finished = asyncio.create_task(done.wait())
+    try:
+        waiting = set(workers) | {finished}
+        while not done.is_set():
+            completed, waiting = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            for task in completed:
+                if task is not finished and task.exception() is not None:
+                    raise task.exception()
+    finally:
+        # Extra workers still queued for a slot are no longer needed
+        for task in workers + [finished]:
+            task.cancel()
+        await asyncio.gather(*workers, finished, return_exceptions=True)
+    return [results[first] for first, _ in chunks]
+
+
+def _field_value(field):
+    return field.value if field.value else field.content
+
+
+def _first_page(field):
+    regions = field.bounding_regions or []
+    return regions[0].page_number if regions else None
+
+
+def _best_fields(results):
+    """The most confident reading of each field, and {name: [[value, confidence, page], ...]}
+    for the fields read with different values in several chunks."""
+    best = {}
+    readings = {}
+    for result in results:
+        for document in result.documents:
+            for name, field in document.fields.items():
+                current = best.get(name)
+                if current is None or (field.confidence or 0) > (current.confidence or 0):
+                    best[name] = field
+                if _field_value(field):
+                    readings.setdefault(name, []).append(field)
+
+    conflicts = {}
+    for name, fields in readings.items():
+        values = {dumps_pretty(_field_value(field)) for field in fields}
+        if len(values) > 1:
+            conflicts[name] = [[_field_value(field), field.confidence, _first_page(field)] for field in fields]
+    return best, conflicts
+
+
+def build_output(result, form_number):
+    """Fill the form's storage tree from one analysis result, or a list of chunk results."""
+    storage, slots = get_form_schema(form_number).new_storage()
+
+    results = result if isinstance(result, (list, tuple)) else [result]
+    fields, conflicts = _best_fields(results)
+    geometry = FieldGeometry.from_fields(fields.items())
+    first_regions = geometry.first_regions().tolist()
+
+    for index, (name, field) in enumerate(fields.items()):
+        value=_field_value(field)
+        #print(f"{name}={value} [{field.confidence}]")
+        set_field(storage, slots, name, FieldResult(value, field.confidence, geometry, first_regions[index]))
+
+    if conflicts:
+        # Readings from other chunks that didn't fill the field, so nothing is dropped silently
+        storage[CHUNK_CONFLICTS] = conflicts
+
+    coordinates = geometry.as_regions(geometry.signature_indices())
+
+    # Dates stay date objects; they are written as ISO strings when the output is encoded
+    return storage, coordinates
+
+
+def _form_fields(output):
+    # The fields of a result, without the chunk conflicts report
+    return iter_fields({key: value for key, value in output.items() if key != CHUNK_CONFLICTS})
+
+
+def _confidence(value):
+    if isinstance(value, FieldResult):
+        return value.confidence
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        return value[1]
+    return None
+
+
+def low_confidence_fields(output, threshold):
+    """{field path: confidence} for the filled fields of a result below threshold."""
+    low = {}
+    for name, value in _form_fields(output):
+        confidence = _confidence(value)
+        if confidence is not None and confidence < threshold:
+            low[name] = confidence
+    return low
+
+
+def extract_pages(file_path, pages):
+    """A new PDF holding only the given 1-based pages, in order, as bytes."""
+    reader = PdfReader(file_path)
+    writer = PdfWriter()
+    for page in pages:
+        writer.add_page(reader.pages[page - 1])
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def field_pages(output):
+    """[[field path, page], ...] for the fields of a result whose page is known, stored with the document."""
+    return [
+        [name, value.page]
+        for name, value in _form_fields(output)
+        if isinstance(value, FieldResult) and value.page is not None
+    ]
+
+
+async def refine_async(file_path, form_number, previous, threshold, pages_by_field, file_hash=None):
+    """Re-analyze only the pages holding fields below threshold and merge better readings into previous.
+
+    pages_by_field maps field paths to the page they were read from (see field_pages).
+    Returns (merged output, report).
+    """
+    model_id = NEURAL_MODELS.get(form_number, "")
+    low = low_confidence_fields(previous, threshold)
+    report = {"threshold": threshold, "low_confidence": len(low), "pages": [], "refined": []}
+    if not low:
+        return previous, report
+
+    pages = sorted({pages_by_field[name] for name in low if name in pages_by_field})
+    report["pages"] = pages
+    if not pages:
+        return previous, report
+
+    if file_hash is None:
+        file_hash = await asyncio.to_thread(_hash_file, file_path)
+    document = await asyncio.to_thread(extract_pages, file_path, pages)
+    refined = await analyze_cached(form_number, model_id, None, hash_bytes(f"{file_hash}:pages:{pages}".encode()), document=document)
+    # Page i of the cropped PDF is pages[i - 1] of the original
+    for analyzed in refined.documents:
+        for field in analyzed.fields.values():
+            for region in field.bounding_regions or []:
+                region.page_number = pages[region.page_number - 1]
+
+    improved, _ = build_output(refined, form_number)
+    for name, value in _form_fields(improved):
+        if name in low and (value.confidence or 0) > low[name]:
+            set_field(previous, {}, name, value)
+            report["refined"].append(name)
+
+    return previous, report
+
+
+async def cached_field_pages(form_number, file_hash):
+    """{field path: page} from a cached neural analysis of the file, or None when it isn't cached."""
+    cached = await result_cache.get((file_hash, NEURAL_MODELS.get(form_number, ""), AZURE_API_VERSION))
+    if cached is None:
+        return None
+    output, _ = build_output(AnalyzeResult.from_dict(cached), form_number)
+    return dict(field_pages(output))
+
+
+async def cached_signature_regions(form_number, file_hash):
+    """Signature regions from a cached neural analysis of the file, or None when it isn't cached."""
+    cached = await result_cache.get((file_hash, NEURAL_MODELS.get(form_number, ""), AZURE_API_VERSION))
+    if cached is None:
+        return None
+    geometry = FieldGeometry.from_result(AnalyzeResult.from_dict(cached))
+    return geometry.as_regions(geometry.signature_indices())
+
+
+def analyze_document(file_path,form_number):
+    """Sync shim around analyze_document_async for scripts."""
+    return _run_sync(analyze_document_async(file_path, form_number))
+
+
+async def analyze_document_async(file_path,form_number, file_hash=None, document=None):
+    """Run the template model and return the signature regions, see components.signatureCrop."""
+    model_id = TEMPLATE_MODELS.get(form_number, "")
 
-    coordinates = []
-    for document in result.documents:
-        for name, field in document.fields.items():
-            if "signature" in name.lower():
-                points = field.bounding_regions[0].polygon
-                for p in points:
-                    coordinates.append((p.x*72, p.y*72))
+    result = await analyze_cached(form_number, model_id, file_path, file_hash, document)
 
-   
-    return coordinates
+    geometry = FieldGeometry.from_result(result)
+    return geometry.as_regions(geometry.signature_indices())
 
-def modify_pdf_with_signature(file_path, coordinates):
+def modify_pdf_with_signature(pdf, coordinates):
+    """Crop every signature region out of the PDF (bytes, or a path for scripts) and return the new PDF as bytes."""
     try:
-        reader = PdfReader(file_path)
-        
-        page = reader.pages[0]
-        original_lower_left = page.cropbox.lower_left
-        original_lower_right = page.cropbox.lower_right
-        original_upper_left = page.cropbox.upper_left
-        original_upper_right = page.cropbox.upper_right
-
-        height_of_pdf = float(original_upper_left[1])
-        width_of_pdf = original_lower_right[0]
-       
-
-        writer = PdfWriter()
-        page.mediabox.upper_left = (float(coordinates[0][0]), height_of_pdf - float(coordinates[0][1]))
-        page.mediabox.upper_right = (float(coordinates[1][0]), height_of_pdf - float(coordinates[1][1]))
-        page.mediabox.lower_right = (float(coordinates[2][0]), height_of_pdf - float(coordinates[2][1]))
-        page.mediabox.lower_left = (float(coordinates[3][0]), height_of_pdf - float(coordinates[3][1]))
-        writer.add_page(page)
-
-        # Create a temporary file to store the modified PDF
-        with NamedTemporaryFile(delete=False) as tmp_file:
-            tmp_file_path = tmp_file.name
-            writer.write(tmp_file)
-        
-        return tmp_file_path
+        if isinstance(pdf, (str, os.PathLike)):
+            with open(pdf, "rb") as f:
+                pdf = f.read()
+        return crop_signatures(pdf, coordinates)
     except Exception as e:
         logger.exception("error coming")
         raise  # Re-raise the exception to propagate it
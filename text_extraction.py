@@ -1,39 +1,60 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime
+import asyncio
 import time
-import shutil
 import os
 import model as Model
-import json
+import orjson
 import jwt  # JWT for decoding token
-import csv
-import PyPDF2
 from reportlab.pdfgen import canvas
-from typing import Optional
+from typing import Optional, List
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from schemas import DocumentSchema, APICallSchema, UserStatisticSchema, AuditLogSchema
-from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from components import database
+from components.billing import compute_billing, compute_billing_totals, billing_page, iter_billing_rows, iter_billing_csv, gzip_chunks, MAX_PAGE_SIZE
+from components.billingRollup import get_monthly_rollup, reconcile_rollups, month_range
+from components.invoice import render_invoice, invoice_cache
 from components.getToken import get_current_user_from_cookie, get_current_user
-from components.logDocument import log_document_processing, update_document_processing
+from components.logDocument import log_document_processing, update_document_processing, get_signature_coordinates, get_field_pages, document_exists
 from components.logApi import log_api_call
 from components.userStatistics import update_user_statistics
 from components.logAudit import log_audit_event
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Image, Spacer
-from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
-from reportlab.lib.units import inch
+from components.azureClients import start_clients, close_clients
+from components.executor import start_executor, shutdown_executor, submit, run, get_executor_stats
+from components.resultCache import result_cache
+from components.ingest import ingest_upload, discard, is_zip, extract_zip
+from components.batch import register_batch, iter_batch_results
+from components.responses import extraction_response, load_result
+from components.signatureCrop import signature_regions, render_signature, image_cache_key, signature_image_cache, IMAGE_FORMATS
+from components.eventBus import start_event_bus, stop_event_bus, publish_task, get_event_bus_stats
+from components.jobs import create_job, owns_file, get_job, start_job_workers, stop_job_workers, latest_job_result, store_job_result
 
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    database.connect()
+    await database.ensure_indexes()
+    start_executor()
+    await start_clients()
+    await start_event_bus()
+    start_job_workers()
+    yield
+    await stop_job_workers()
+    await stop_event_bus()
+    await close_clients()
+    shutdown_executor()
+    database.close()
 
-upload_dir = "uploads"
-os.makedirs(upload_dir, exist_ok=True)
+
+app = FastAPI(lifespan=lifespan)
 
 # Get the frontend URL from the .env file
 FRONTEND_URL = os.getenv("FRONTEND_URL")
@@ -61,20 +82,12 @@ async def log_requests(request: Request, call_next):
 
     return response
 
-# Get the secret key and mongodb url from the .env file
+# Get the secret key from the .env file
 SECRET_KEY = os.getenv("SECRET_KEY")
-MONGODB_URL = os.getenv("MONGODB_URL")
-client = AsyncIOMotorClient(MONGODB_URL)
-database = client["audit_logs_db"]
-
-documents_collection = database.get_collection("documents")
-api_calls_collection = database.get_collection("api_calls")
-user_statistics_collection = database.get_collection("user_statistics")
-audit_logs_collection = database.get_collection("audit_logs")
 
 # Endpoint to extract and process a file
 @app.post("/extract/")
-async def extract_file(request: Request, file: UploadFile = File(...), form_number: int = File(...), doc_id: Optional[str]= File(...)):
+async def extract_file(request: Request, file: UploadFile = File(...), form_number: int = File(...), doc_id: Optional[str]= File(...), pages_per_chunk: Optional[int] = File(None)):
     # Print all cookies received in the request
     
     # Decode user from JWT token in the cookie
@@ -83,31 +96,42 @@ async def extract_file(request: Request, file: UploadFile = File(...), form_numb
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized: No valid user token found")
 
+    ingested = None
     try:
-        file_path = os.path.join(upload_dir, file.filename)
         print(f"User details: {user}")
 
-        # Save the file
-        with open(file_path, "wb") as image:
-            shutil.copyfileobj(file.file, image)
-        
-        file_path1 = file_path
+        # Checked before paying for the analysis: the result is recorded against this document
+        if not await document_exists(user["id"], doc_id):
+            raise HTTPException(status_code=404, detail="Document not found")
+
+        # Stream the upload to a unique file, hashing it on the way
+        ingested = await ingest_upload(file)
 
         # Call the model to process the file
         start_time = datetime.utcnow()
-        output = Model.myModel(file_path1, form_number)
+        # pages_per_chunk splits long PDFs and analyses the page ranges concurrently
+        output, signature_coordinates = await run(Model.NEURAL_MODELS.get(form_number, ""), Model.extract_with_signature_async, ingested.path, form_number, ingested.sha256, pages_per_chunk)
         end_time = datetime.utcnow()
 
         # Calculate processing duration
         processing_duration = round((end_time - start_time).total_seconds(), 1)
 
-        # Update document processing with the duration
-        await update_document_processing(
+        # Update document processing with the duration and signature regions before answering,
+        # so a /get_signature/ call right after finds them; the audit writes below are queued
+        # on the event bus. If the write fails here the bus retries it.
+        document_update = dict(
             user_id=user["id"],
             doc_id=doc_id,
             status="processed",
-            processing_duration=processing_duration
+            processing_duration=processing_duration,
+            signature_coordinates=signature_coordinates,
+            field_pages=Model.field_pages(output)
         )
+        try:
+            await update_document_processing(**document_update)
+        except PyMongoError as e:
+            print(f"Error updating document {doc_id}, retrying in the background: {e}")
+            await publish_task(update_document_processing, **document_update)
 
         # Log the API call
         await log_api_call(user["id"], doc_id, "/extract/", "success")
@@ -119,29 +143,18 @@ async def extract_file(request: Request, file: UploadFile = File(...), form_numb
         # Update user statistics
         await update_user_statistics(user["id"], documents_processed=1, api_calls=1)
 
-        # Write output to JSON file
-        with open('output.json', 'w') as f:
-            json.dump(output, f)
-
-        # Stream JSON file as response
-        def iterfile():
-            with open('output.json', 'rb') as f:
-                yield from f
+        # Serialize once and answer from memory
+        response = await extraction_response(output, user["id"], doc_id)
 
-        # Send JSON file as response
-        response = StreamingResponse(iterfile(), media_type='application/json',
-                                     headers={'Content-Disposition': 'attachment;filename=output.json'})
-
-        # Cleanup file
-        os.remove(file_path1)
-        
         # response["document_id"]=document_id
 
         return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error during file extract: {e}")
-        await update_document_processing(
+        await publish_task(update_document_processing,
             user_id=user["id"],
             doc_id=doc_id,
             status="failed",
@@ -150,6 +163,177 @@ async def extract_file(request: Request, file: UploadFile = File(...), form_numb
         await log_api_call(user["id"], doc_id, "/extract/", "error")
         # await log_audit_event(user["id"], "document_processing_failed", f"Failed to process document {file.filename}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    finally:
+        # Cleanup file
+        discard(ingested)
+
+
+# Extract many documents in one request. `files` may hold PDFs/images and zip archives;
+# `form_numbers` is an optional JSON object {filename: form_number} overriding `form_number`.
+# One NDJSON line is streamed per document as soon as its analysis finishes.
+@app.post("/extract/batch/")
+async def extract_batch(request: Request, files: List[UploadFile] = File(...), form_number: Optional[int] = File(None), form_numbers: Optional[str] = File(None)):
+    user = get_current_user_from_cookie(request)
+
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized: No valid user token found")
+
+    try:
+        overrides = orjson.loads(form_numbers) if form_numbers else {}
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="form_numbers must be a JSON object of filename to form number")
+    if not isinstance(overrides, dict):
+        raise HTTPException(status_code=400, detail="form_numbers must be a JSON object of filename to form number")
+
+    items = []
+    try:
+        for file in files:
+            ingested = await ingest_upload(file)
+            if is_zip(ingested):
+                try:
+                    documents = await asyncio.to_thread(extract_zip, ingested)
+                finally:
+                    discard(ingested)
+            else:
+                documents = [ingested]
+            for document in documents:
+                items.append((document, overrides.get(document.filename, form_number)))
+
+        missing = [document.filename for document, number in items if number not in Model.NEURAL_MODELS]
+        if not items:
+            raise HTTPException(status_code=400, detail="No documents in the request")
+        if missing:
+            raise HTTPException(status_code=400, detail=f"No valid form_number for: {', '.join(missing)}")
+
+        document_ids = await register_batch(user["id"], items)
+
+    except Exception as e:
+        for document, _ in items:
+            discard(document)
+        if isinstance(e, HTTPException):
+            raise
+        print(f"Error during batch upload: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    return StreamingResponse(iter_batch_results(user["id"], items, document_ids), media_type="application/x-ndjson")
+
+
+# Re-analyze only the pages of fields whose confidence is below `threshold` and merge the
+# better readings into the previous result. `previous` is the earlier /extract/ output as JSON;
+# without it the stored result (PERSIST_RESULTS_DIR or the document's last job) is used.
+# Answers 409 when the document has no stored field pages (processed before they were kept).
+@app.post("/extract/refine/")
+async def refine_extraction(request: Request, file: UploadFile = File(...), form_number: int = File(...), doc_id: str = File(...),
+                            threshold: float = File(0.8), previous: Optional[str] = File(None)):
+    user = get_current_user_from_cookie(request)
+
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized: No valid user token found")
+
+    ingested = None
+    try:
+        if previous:
+            try:
+                previous_output = orjson.loads(previous)
+            except orjson.JSONDecodeError:
+                raise HTTPException(status_code=400, detail="previous must be the JSON result of /extract/")
+        else:
+            previous_output = await load_result(user["id"], doc_id) or await latest_job_result(user["id"], doc_id)
+        if not isinstance(previous_output, dict):
+            raise HTTPException(status_code=404, detail="No previous result found for this document")
+
+        ingested = await ingest_upload(file)
+
+        # Pages stored by /extract/, else from a cached analysis; never a fresh full analysis
+        pages_by_field = await get_field_pages(user["id"], doc_id) or await Model.cached_field_pages(form_number, ingested.sha256)
+        if pages_by_field is None:
+            raise HTTPException(status_code=409, detail="Field pages of this document are unknown; run /extract/ on it again first")
+
+        start_time = datetime.utcnow()
+        output, report = await run(Model.NEURAL_MODELS.get(form_number, ""), Model.refine_async, ingested.path, form_number, previous_output, threshold, pages_by_field, ingested.sha256)
+        processing_duration = round((datetime.utcnow() - start_time).total_seconds(), 1)
+        print(f"Refined {len(report['refined'])} of {report['low_confidence']} fields on pages {report['pages']}")
+
+        await publish_task(update_document_processing,
+            user_id=user["id"],
+            doc_id=doc_id,
+            status="processed",
+            processing_duration=processing_duration
+        )
+        if report["refined"]:
+            await publish_task(store_job_result, user["id"], doc_id, output)
+
+        await log_api_call(user["id"], doc_id, "/extract/refine/", "success")
+        await log_audit_event(user["id"], "API_call_made", "/extract/refine/")
+        await update_user_statistics(user["id"], documents_processed=0, api_calls=1)
+
+        # Also rewrites the persisted result when persistence is on
+        return await extraction_response(output, user["id"], doc_id)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error during refine: {e}")
+        await log_api_call(user["id"], doc_id, "/extract/refine/", "error")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    finally:
+        discard(ingested)
+
+
+# Queue an extraction and answer with the job id straight away; the analysis runs
+# on the job workers and the result is fetched from /jobs/{job_id}
+@app.post("/jobs/extract", status_code=202)
+async def create_extraction_job(request: Request, file: UploadFile = File(...), form_number: int = File(...), doc_id: Optional[str] = File(...)):
+    user = get_current_user_from_cookie(request)
+
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized: No valid user token found")
+
+    ingested = None
+    job = None
+    try:
+        ingested = await ingest_upload(file)
+        job = await create_job(user["id"], doc_id, form_number, ingested)
+        return {"job_id": str(job["_id"]), "status": job["status"]}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error creating extraction job: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    finally:
+        # The job keeps the upload; a retry of an existing job doesn't need this copy
+        if not owns_file(job, ingested):
+            discard(ingested)
+
+
+# Poll an extraction job
+@app.get("/jobs/{job_id}")
+async def get_extraction_job(request: Request, job_id: str):
+    user = get_current_user_from_cookie(request)
+
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized: No valid user token found")
+
+    job = await get_job(user["id"], job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    body = {
+        "job_id": str(job["_id"]),
+        "doc_id": job["doc_id"],
+        "form_number": job["form_number"],
+        "status": job["status"],
+        "attempts": job.get("attempts", 0),
+        "created_at": job["created_at"],
+        "finished_at": job.get("finished_at"),
+    }
+    if job["status"] == "done":
+        body["processing_duration"] = job.get("processing_duration")
+        body["result"] = job["result"]
+    elif job["status"] == "failed":
+        body["error"] = job.get("error")
+    return Response(content=orjson.dumps(body), media_type="application/json")
 
 
 # Endpoint to upload a file
@@ -163,23 +347,16 @@ async def upload_file(request: Request, file: UploadFile = File(...)):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized: No valid user token found")
 
+    file_size = 0
+    num_pages = 0
     try:
-        file_path = os.path.join(upload_dir, file.filename)
         print(f"User details: {user}")
 
-        # Save the file
-        with open(file_path, "wb") as image:
-            shutil.copyfileobj(file.file, image)
+        # Size, hash and page count in a single pass; the bytes are not kept
+        ingested = await ingest_upload(file, save=False)
+        file_size = ingested.size
+        num_pages = ingested.pages
 
-        # Get the file size in bytes
-        file.file.seek(0, os.SEEK_END)
-        file_size = file.file.tell()
-        file.file.seek(0, os.SEEK_SET)
-        
-        # Get the number of pages in the PDF
-        reader = PyPDF2.PdfReader(file.file)
-        num_pages = len(reader.pages)
-    
 
         # Log document processing with the duration
         document_id = await log_document_processing(
@@ -203,6 +380,8 @@ async def upload_file(request: Request, file: UploadFile = File(...)):
 
         return document_id
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error during file uploading in db: {e}")
         document_id = await log_document_processing(
@@ -220,32 +399,55 @@ async def upload_file(request: Request, file: UploadFile = File(...)):
 
 # Endpoint to extract signature from a document
 @app.post("/get_signature/")
-async def get_signature(request: Request, file: UploadFile = File(...), form_number: int = File(...), doc_id: str= File(...)):
+# output_format=png|webp returns the signature at `index` as a small image instead of the cropped PDF
+async def get_signature(request: Request, file: UploadFile = File(...), form_number: int = File(...), doc_id: str= File(...),
+                        output_format: str = File("pdf"), index: int = File(0)):
     user = get_current_user_from_cookie(request)
 
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized: No valid user token found")
 
+    output_format = output_format.lower()
+    if output_format != "pdf" and output_format not in IMAGE_FORMATS:
+        raise HTTPException(status_code=400, detail="output_format must be 'pdf', 'png' or 'webp'")
+
     try:
         print(f"User details: {user}")
-        # Save the file
-        file_path = os.path.join(upload_dir, file.filename)
-        with open(file_path, "wb") as image:
-            shutil.copyfileobj(file.file, image)
-        
+        # Hash and size-check the upload, then keep its bytes in memory; nothing is written to disk
+        ingested = await ingest_upload(file, save=False)
+        await file.seek(0)
+        pdf_bytes = await file.read()
+
         start_time = time.time()
-        # Analyze the document for signature
-        coordinates = Model.analyze_document(file_path, form_number)
+        # Reuse the signature regions found by /extract/, only analyze again if there are none
+        coordinates = await get_signature_coordinates(user["id"], doc_id)
+        if not coordinates:
+            # The neural analysis behind /extract/ is usually still cached
+            coordinates = await Model.cached_signature_regions(form_number, ingested.sha256)
+        if not coordinates:
+            coordinates = await run(Model.TEMPLATE_MODELS.get(form_number, ""), Model.analyze_document_async, None, form_number, ingested.sha256, pdf_bytes)
         end_time = time.time()
         # Update document processing
         processing_duration = round((end_time - start_time), 1)
 
-        # Modify the PDF with the extracted signature
-        modified_pdf_path = Model.modify_pdf_with_signature(file_path, coordinates)
-        # Return the modified PDF
-        response = FileResponse(modified_pdf_path, filename="output.pdf", media_type="application/pdf")
-
-        await update_document_processing(
+        if output_format == "pdf":
+            # Crop every signature region (any page) into a new PDF
+            cropped_pdf = await submit("signature_crop", Model.modify_pdf_with_signature, pdf_bytes, coordinates)
+            response = Response(content=cropped_pdf, media_type="application/pdf",
+                                headers={"Content-Disposition": "attachment;filename=output.pdf"})
+        else:
+            regions = signature_regions(coordinates)
+            if not 0 <= index < len(regions):
+                raise HTTPException(status_code=404, detail=f"Signature {index} not found; the document has {len(regions)}")
+            key = image_cache_key(ingested.sha256, regions[index], output_format)
+            image = signature_image_cache.get(key)
+            if image is None:
+                image = await submit("signature_render", render_signature, pdf_bytes, regions[index], output_format)
+                signature_image_cache.set(key, image)
+            response = Response(content=image, media_type=IMAGE_FORMATS[output_format][1],
+                                headers={"Cache-Control": "private, max-age=3600"})
+
+        await publish_task(update_document_processing,
             user_id=user["id"],
             doc_id=doc_id,
             status="processed",
@@ -264,14 +466,13 @@ async def get_signature(request: Request, file: UploadFile = File(...), form_num
         # and get_signature(this is a optional call)
         await update_user_statistics(user["id"], documents_processed=0, api_calls=1)
 
-        # Clean up
-        os.remove(file_path)
-
         return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error during signature extraction: {e}")
-        await update_document_processing(
+        await publish_task(update_document_processing,
             user_id=user["id"],
             doc_id=doc_id,
             status="failed",
@@ -281,266 +482,135 @@ async def get_signature(request: Request, file: UploadFile = File(...), form_num
         # await log_audit_event(user["id"], "document_processing_failed", f"Failed to process document {file.filename}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+# Endpoint to inspect the extraction worker pool
+@app.get("/metrics/extraction/")
+async def extraction_metrics(request: Request):
+    user = get_current_user_from_cookie(request)
+
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized: No valid user token found")
+
+    stats = get_executor_stats()
+    stats["result_cache"] = result_cache.stats()
+    stats["signature_image_cache"] = signature_image_cache.stats()
+    stats["event_bus"] = get_event_bus_stats()
+    return stats
+
+
+# Billing summary. Without paging params the full summary is returned as before;
+# with `limit`/`after` one keyset page of `section` is returned, and with stream=true
+# rows are streamed as NDJSON straight from the database cursor.
 @app.get("/billing/")
-async def get_billing(request: Request):
+async def get_billing(request: Request, section: Optional[str] = None, after: Optional[str] = None, limit: Optional[int] = None,
+                      start: Optional[datetime] = None, end: Optional[datetime] = None, stream: bool = False):
     user = get_current_user_from_cookie(request)
 
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized: No valid user token found")
 
-    user_id = user["id"]
-    user_stats = await user_statistics_collection.find_one({"user_id": user_id})
-    if not user_stats:
+    if section not in (None, "documents", "api_calls"):
+        raise HTTPException(status_code=400, detail="section must be 'documents' or 'api_calls'")
+    if after is not None and not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail="after must be an ObjectId")
+    # Checked before streaming: once the 200 headers are out a Mongo error truncates the body
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+
+    if stream:
+        sections = [section] if section else ["documents", "api_calls"]
+        limit = min(limit, MAX_PAGE_SIZE) if limit is not None else None
+
+        async def iter_ndjson():
+            for name in sections:
+                async for row in iter_billing_rows(user["id"], name, after, limit, start, end):
+                    row["kind"] = name
+                    yield orjson.dumps(row) + b"\n"
+
+        return StreamingResponse(iter_ndjson(), media_type="application/x-ndjson")
+
+    if limit is not None or after is not None:
+        totals = await compute_billing_totals(user["id"], start, end)
+        if not totals:
+            raise HTTPException(status_code=404, detail="User statistics not found")
+        page = await billing_page(user["id"], section or "documents", after, limit or MAX_PAGE_SIZE, start, end)
+        return {**totals, **page}
+
+    billing_data = await compute_billing(user["id"], start=start, end=end)
+    if not billing_data:
         raise HTTPException(status_code=404, detail="User statistics not found")
-
-    documents = await documents_collection.find({"user_id": user_id}).to_list(length=100)
-    api_calls = await api_calls_collection.find({"user_id": user_id}).to_list(length=100)
-
-    document_rate_per_kb = 0.02
-    api_rate = 0.05
-
-    total_document_cost = 0
-    document_summary = []
-    for doc in documents:
-        doc_size_in_kb = doc["size"] / 1024
-        doc_charge = doc_size_in_kb * document_rate_per_kb
-        document_api_calls = await api_calls_collection.find({"document_id": doc["_id"]}).to_list(length=100)
-
-        document_summary.append({
-            "document_id": str(doc["_id"]),
-            "document_name": doc["document_name"],
-            "type": doc["type"],
-            "size": doc["size"],
-            "number_of_pages": doc.get("number_of_pages", None),
-            "processing_timestamp": doc["processing_timestamp"],
-            "processing_duration": doc.get("processing_duration", None),
-            "status": doc["status"],
-            "charges": doc_charge,
-            "api_calls": [{
-                "api_request_id": str(api["_id"]),
-                "timestamp": api["timestamp"],
-                "api_endpoint": api["api_endpoint"],
-                "status": api["status"]
-            } for api in document_api_calls]
-        })
-        total_document_cost += doc_charge
-
-    total_api_cost = 0
-    api_call_summary = []
-    for api_call in api_calls:
-        api_call_charge = api_rate
-        api_call_summary.append({
-            "api_request_id": str(api_call["_id"]),
-            "timestamp": api_call["timestamp"],
-            "api_endpoint": api_call["api_endpoint"],
-            "status": api_call["status"],
-            "charges": api_call_charge
-        })
-        total_api_cost += api_call_charge
-
-    total_cost = total_document_cost + total_api_cost
-
-    return {
-        "total_documents_processed": user_stats["total_documents_processed"],
-        "total_api_calls": user_stats["total_api_calls"],
-        "billing_period_start": user_stats["billing_period_start"],
-        "billing_period_end": user_stats["billing_period_end"],
-        "total_charges": total_cost,
-        "documents": document_summary,
-        "api_calls": api_call_summary
-    }
+    return billing_data
 
 
-async def get_billing_(token:str):
+# Invoice data for one month (YYYY-MM, default current): totals come from the monthly rollup,
+# the itemised rows from the raw collections for that month
+async def get_billing_(token:str, month: Optional[str] = None):
     user = get_current_user(token)
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized: No valid user token found")
 
-    user_id = user["id"]
-    user_stats = await user_statistics_collection.find_one({"user_id": user_id})
-    if not user_stats:
+    month = month or datetime.utcnow().strftime("%Y-%m")
+    try:
+        period_start, period_end, period_last = month_range(month)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month must be formatted as YYYY-MM")
+
+    billing_data = await compute_billing(user["id"], include_document_api_calls=False, start=period_start, end=period_end, month=month)
+    if not billing_data:
         raise HTTPException(status_code=404, detail="User statistics not found")
 
-    documents = await documents_collection.find({"user_id": user_id}).to_list(length=100)
-    api_calls = await api_calls_collection.find({"user_id": user_id}).to_list(length=100)
-
-    document_rate_per_kb = 0.02
-    api_rate = 0.05
-
-    total_document_cost = 0
-    document_summary = []
-    for doc in documents:
-        doc_size_in_kb = doc["size"] / 1024
-        doc_charge = doc_size_in_kb * document_rate_per_kb
-        document_summary.append({
-            "document_id": str(doc["_id"]),
-            "document_name": doc["document_name"],
-            "type": doc["type"],
-            "size": doc["size"],
-            "number_of_pages": doc.get("number_of_pages", None),
-            "processing_timestamp": doc["processing_timestamp"],
-            "charges": doc_charge
-        })
-        total_document_cost += doc_charge
-
-    total_api_cost = 0
-    api_call_summary = []
-    for api_call in api_calls:
-        api_call_charge = api_rate
-        api_call_summary.append({
-            "api_request_id": str(api_call["_id"]),
-            "timestamp": api_call["timestamp"],
-            "api_endpoint": api_call["api_endpoint"],
-            "status": api_call["status"],
-            "charges": api_call_charge
+    rollup = await get_monthly_rollup(user["id"], month)
+    if rollup is None:
+        # Not built yet (e.g. history from before rollups existed): rebuild it from the raw rows
+        await reconcile_rollups(user["id"], month)
+        rollup = await get_monthly_rollup(user["id"], month)
+    if rollup is not None:
+        # total_documents_processed stays the month's extraction count from user_statistics;
+        # the rollup's document_count counts uploads
+        billing_data.update({
+            "total_api_calls": rollup.get("api_calls_total", 0),
+            "total_charges": rollup.get("charges", {}).get("total", 0),
+            "rollup_version": rollup.get("version", 0),
         })
-        total_api_cost += api_call_charge
-
-    total_cost = total_document_cost + total_api_cost
-
-    return {
-        "total_documents_processed": user_stats["total_documents_processed"],
-        "total_api_calls": user_stats["total_api_calls"],
-        "billing_period_start": user_stats["billing_period_start"],
-        "billing_period_end": user_stats["billing_period_end"],
-        "total_charges": total_cost,
-        "documents": document_summary,
-        "api_calls": api_call_summary
-    }
+    billing_data.update({"month": month, "billing_period_start": period_start, "billing_period_end": period_last})
+    return billing_data
 
 
-# Route to generate PDF
+# Route to generate PDF (?month=YYYY-MM). Rendered off the event loop and cached per
+# rollup version, so repeat downloads of a closed month skip the rendering entirely.
 @app.get("/billing/pdf/")
 async def generate_billing_pdf(request: Request):
     token = request.query_params.get("token")
-    billing_data = await get_billing_(token)
+    month = request.query_params.get("month") or datetime.utcnow().strftime("%Y-%m")
     user_data = get_current_user(token)
-    pdf_file = "billing_invoice.pdf"
-    
-    pdf = SimpleDocTemplate(pdf_file, pagesize=A4, rightMargin=20, leftMargin=20, topMargin=40, bottomMargin=40)
-    styles = getSampleStyleSheet()
-    elements = []
-
-    # Add company logo
-    logo_path = "aeroqube-logo.webp"
-    logo = Image(logo_path, 4 * inch, 1.2 * inch)
-    logo.hAlign = 'CENTER'
-    elements.append(logo)
-
-    # Title with enhanced styling
-    title_style = ParagraphStyle('TitleStyle', fontSize=16, textColor=colors.HexColor('#2E86C1'), alignment=1, spaceAfter=12)
-    title = Paragraph("Monthly Billing Statement", title_style)
-    elements.append(title)
-
-    # User Information Section in two-column format
-    user_info_table_data = [
-        ["User:", user_data['email']],
-        ["Billing Date:", datetime.now().strftime("%Y-%m-%d")],
-        ["Billing Period:", f"{billing_data['billing_period_start']} - {billing_data['billing_period_end']}"],
-        ["Total Documents Processed:", billing_data['total_documents_processed']],
-        ["Total API Calls:", billing_data['total_api_calls']],
-        ["Total Charges:", f"Rs. {billing_data['total_charges']:.2f}"],
-    ]
-
-    # Style the User Info Table
-    user_info_table = Table(user_info_table_data, colWidths=[2.5 * inch, 3.5 * inch])
-    user_info_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-        ('ALIGN', (1, 0), (1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#2E86C1')),
-        ('TOPPADDING', (0, 0), (-1, -1), 5),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
-    ]))
-    elements.append(user_info_table)
-    elements.append(Spacer(1, 12))
-
-    # Document Summary Table
-    elements.append(Paragraph("<b>Document Summary:</b>", styles['Heading2']))
-    doc_table_data = [["Document Name", "Size (KB)", "Pages", "Date Processed", "Charges (Rs.)"]]
-    for i, doc in enumerate(billing_data['documents']):
-        doc_table_data.append([
-            doc['document_name'], f"{doc['size'] / 1024:.2f}", 
-            doc['number_of_pages'], doc['processing_timestamp'], 
-            f"Rs. {doc['charges']:.2f}"
-        ])
-
-    doc_table = Table(doc_table_data, colWidths=[2*inch, 1*inch, 1*inch, 2*inch, 1.5*inch])
-    doc_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2E86C1')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 11),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.lightgrey),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.whitesmoke, colors.lightgrey]),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-        ('TOPPADDING', (0, 0), (-1, 0), 8),
-    ]))
-    elements.append(doc_table)
-
-    # API Call Summary Table
-    elements.append(Paragraph("<b>API Call Summary:</b>", styles['Heading2']))
-    api_table_data = [["API Endpoint", "Date", "Charges (Rs.)"]]
-
-    for i, api in enumerate(billing_data['api_calls']):
-        api_table_data.append([
-            api['api_endpoint'], api['timestamp'], 
-            f"Rs. {api['charges']:.2f}"
-        ])
-
-    api_table = Table(api_table_data, colWidths=[3*inch, 2*inch, 1.5*inch])
-    api_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2E86C1')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 11),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.whitesmoke, colors.lightgrey]),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-        ('TOPPADDING', (0, 0), (-1, 0), 8),
-    ]))
-    elements.append(api_table)
-
-    # Billing Summary Section
-    elements.append(Paragraph("<b>Billing Summary:</b>", styles['Heading2']))
-    summary = f"""
-    <b>Total Documents Processed:</b> {billing_data['total_documents_processed']}<br/>
-    <b>Total API Calls:</b> {billing_data['total_api_calls']}<br/>
-    <b>Total Charges:</b> Rs. {billing_data['total_charges']:.2f}<br/>
-    """
-    elements.append(Paragraph(summary, styles['Normal']))
-
-    # Build and return the PDF
-    pdf.build(elements)
-    return FileResponse(pdf_file, media_type="application/pdf", filename="billing_invoice.pdf")
-
-
-# Route to generate CSV
+    if not user_data:
+        raise HTTPException(status_code=401, detail="Unauthorized: No valid user token found")
+
+    headers = {"Content-Disposition": "attachment;filename=billing_invoice.pdf"}
+    rollup = await get_monthly_rollup(user_data["id"], month)
+    if rollup is not None:
+        pdf_bytes = invoice_cache.get((user_data["id"], month, rollup.get("version", 0)))
+        if pdf_bytes is not None:
+            return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
+
+    billing_data = await get_billing_(token, month)
+    pdf_bytes = await submit("invoice_render", render_invoice, billing_data, user_data['email'])
+    if "rollup_version" in billing_data:
+        invoice_cache.set((user_data["id"], month, billing_data["rollup_version"]), pdf_bytes)
+    return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
+
+
+# Route to generate CSV, streamed from the database (add gzip=true for a compressed download)
 @app.get("/billing/csv/")
-async def generate_billing_csv(request: Request):
+async def generate_billing_csv(request: Request, start: Optional[datetime] = None, end: Optional[datetime] = None, gzip: bool = False):
     # Extract token from query parameters
     token = request.query_params.get("token")
     user = get_current_user(token)  # Assumed you have a function to get user data
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized: No valid user token found")
 
-    billing_data = {
-        "api_calls": [
-            {"api_endpoint": "/extract/", "timestamp": "2023-10-01T12:00:00Z", "status": "success", "charges": 10},
-            {"api_endpoint": "/get_signature/", "timestamp": "2023-10-02T12:00:00Z", "status": "success", "charges": 15},
-        ]
-    }
-
-    csv_file = "billing_report.csv"
-    with open(csv_file, mode="w", newline='', encoding="utf-8") as file:
-        writer = csv.writer(file)
-        writer.writerow([])
-        writer.writerow(["API Endpoint", "Date", "Time", "Status", "Charges (Rs.)"])
-        for api in billing_data['api_calls']:
-            writer.writerow([api['api_endpoint'], api['timestamp'], api['status'], api['charges']])
-
-    return FileResponse(csv_file, media_type="text/csv", filename="billing_report.csv")
\ No newline at end of file
+    chunks = iter_billing_csv(user["id"], start, end)
+    if gzip:
+        return StreamingResponse(gzip_chunks(chunks), media_type="application/gzip",
+                                 headers={"Content-Disposition": "attachment;filename=billing_report.csv.gz"})
+    return StreamingResponse(chunks, media_type="text/csv",
+                             headers={"Content-Disposition": "attachment;filename=billing_report.csv"})